@@ -0,0 +1,214 @@
+"""
+房間頁面讀取 API 的負載比較：多執行緒 WSGI（gunicorn gthread）與 ASGI（uvicorn + asgi.py）
+
+用法：python bench/bench_async.py [--clients 200] [--duration 10] [--expenses 500]
+      [--workers 1] [--threads 8] [--modes wsgi,asgi]
+
+在暫存目錄建立一個房間與支出，分別啟動兩種伺服器（相同的 worker 數），
+以 N 個保持連線的用戶端反覆開啟房間頁面（/api/auth/me、房間、第一頁支出、結算四個請求），回報：
+- 每秒請求數與每秒開啟的頁面數
+- 單一請求延遲百分位數
+需要安裝 gunicorn 與 uvicorn，未安裝的模式會略過。
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+SECRET_KEY = "bench-async-secret"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def build_data(expense_count, member_count):
+    """在目前目錄建立資料庫、房間與支出，回傳 (room_id, session cookie)"""
+    from app import app
+    from database import init_db
+    from models import create_user
+    
+    init_db()
+    members = [f"user{i}@example.com" for i in range(member_count)]
+    with app.app_context():
+        for i, email in enumerate(members):
+            create_user(email, f"User {i}")
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['email'] = members[0]
+    room_id = client.post('/api/rooms', json={'name': 'bench'}).get_json()['room_id']
+    for email in members[1:]:
+        client.post(f'/api/rooms/{room_id}/invite', json={'email': email})
+    
+    for start in range(0, expense_count, 500):
+        batch = [
+            {
+                'title': f'expense {i}',
+                'amount': 100 + i,
+                'payer': members[i % member_count],
+                'participants': members[:2 + i % (member_count - 1)]
+            }
+            for i in range(start, min(start + 500, expense_count))
+        ]
+        client.post(f'/api/rooms/{room_id}/expenses:batch', json={'expenses': batch})
+    
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'email': members[0]})
+    return room_id, cookie
+
+def server_command(mode, port, args, workdir):
+    if mode == "wsgi":
+        return [
+            sys.executable, "-m", "gunicorn",
+            "--chdir", workdir, "--pythonpath", SRC,
+            "-k", "gthread", "-w", str(args.workers), "--threads", str(args.threads),
+            "--keep-alive", "5", "-b", f"127.0.0.1:{port}", "--log-level", "warning",
+            "wsgi:app"
+        ]
+    return [
+        sys.executable, "-m", "uvicorn", "asgi:app",
+        "--app-dir", SRC, "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"
+    ]
+
+def wait_for(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"伺服器未在 {timeout} 秒內啟動")
+
+async def fetch(reader, writer, path, cookie):
+    """以保持連線送出 GET，回傳狀態碼（只處理 Content-Length 與 chunked 回應）"""
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: session={cookie}\r\n\r\n".encode('latin-1')
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status
+
+async def client_loop(port, paths, cookie, deadline, latencies, counters):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while time.perf_counter() < deadline:
+            for path in paths:
+                start = time.perf_counter()
+                try:
+                    status = await fetch(reader, writer, path, cookie)
+                except (OSError, asyncio.IncompleteReadError):
+                    counters["errors"] += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    counters["errors"] += 1
+            counters["pages"] += 1
+    finally:
+        writer.close()
+
+async def run_load(port, paths, cookie, clients, duration):
+    latencies = []
+    counters = {"pages": 0, "errors": 0}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        client_loop(port, paths, cookie, deadline, latencies, counters) for _ in range(clients)
+    ])
+    elapsed = time.perf_counter() - start
+    return latencies, counters, elapsed
+
+def run_mode(mode, args, workdir, room_id, cookie):
+    port = free_port()
+    env = dict(os.environ, SECRET_KEY=SECRET_KEY)
+    process = subprocess.Popen(server_command(mode, port, args, workdir), env=env, cwd=workdir)
+    try:
+        wait_for(port)
+        paths = [
+            "/api/auth/me",
+            f"/api/rooms/{room_id}",
+            f"/api/rooms/{room_id}/expenses",
+            f"/api/rooms/{room_id}/settlement",
+        ]
+        # 暖身：載入模組、建立連線與快取
+        asyncio.run(run_load(port, paths, cookie, min(args.clients, 10), 1))
+        latencies, counters, elapsed = asyncio.run(run_load(port, paths, cookie, args.clients, args.duration))
+        return {
+            "mode": mode,
+            "requests_per_second": len(latencies) / elapsed,
+            "pages_per_second": counters["pages"] / elapsed,
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "errors": counters["errors"],
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="比較多執行緒 WSGI 與 ASGI 的房間頁面吞吐量")
+    parser.add_argument("--clients", type=int, default=200, help="同時保持連線的用戶端數")
+    parser.add_argument("--duration", type=float, default=10, help="每種模式的測試秒數")
+    parser.add_argument("--expenses", type=int, default=500)
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1, help="兩種模式的 worker 行程數")
+    parser.add_argument("--threads", type=int, default=8, help="WSGI 模式每個 worker 的執行緒數")
+    parser.add_argument("--modes", default="wsgi,asgi")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="splitwise-bench-async-")
+    os.chdir(workdir)
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    room_id, cookie = build_data(args.expenses, args.members)
+    
+    print(f"{args.clients} 個用戶端、{args.duration:.0f} 秒、{args.workers} 個 worker，"
+          f"房間 {args.expenses} 筆支出、{args.members} 位成員")
+    print(f"{'mode':>6} {'req/s':>9} {'pages/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(","):
+        mode = mode.strip()
+        server_module = "gunicorn" if mode == "wsgi" else "uvicorn"
+        if importlib.util.find_spec(server_module) is None:
+            print(f"{mode:>6} 略過（未安裝 {server_module}）")
+            continue
+        result = run_mode(mode, args, workdir, room_id, cookie)
+        print(f"{result['mode']:>6} {result['requests_per_second']:9.0f} {result['pages_per_second']:9.0f} "
+              f"{result['p50']:8.1f} {result['p95']:8.1f} {result['p99']:8.1f} {result['errors']:7d}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+大型支出回應的序列化與壓縮成本
+
+用法：python bench/bench_json.py [--expenses 5000] [--members 30] [--repeat 5]
+
+以合成的支出列表與結算（與 /api/rooms/<id>/expenses、/settlement 的格式相同）比較：
+- Flask 預設的 JSON provider（標準函式庫、排序 key、跳脫非 ASCII）、精簡的標準函式庫、orjson、ujson
+- gzip（不同等級）與 brotli 的壓縮後大小與耗時
+未安裝的套件會略過。不需要資料庫。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+def build_payload(expense_count, member_count, seed):
+    """合成一個房間的支出列表與結算回應"""
+    rng = random.Random(seed)
+    members = [f"user{i}@example.com" for i in range(member_count)]
+    names = {email: f"成員{i}" for i, email in enumerate(members)}
+    titles = ["晚餐", "計程車", "住宿", "超市採買", "門票", "早餐咖啡", "高鐵車票"]
+    
+    expenses = []
+    for i in range(expense_count):
+        payer = rng.choice(members)
+        participants = sorted(rng.sample(members, rng.randint(2, min(8, member_count))))
+        expenses.append({
+            "id": expense_count - i,
+            "title": f"{rng.choice(titles)} #{i}",
+            "amount": rng.randint(50, 20000),
+            "payer_email": payer,
+            "payer_name": names[payer],
+            "created_at": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:{i % 60:02d}:00",
+            "participants": participants,
+            "participant_names": {email: names[email] for email in participants}
+        })
+    
+    balances = [{"email": email, "balance": rng.randint(-50000, 50000), "name": names[email]} for email in members]
+    payments = [
+        {"from": members[i], "to": members[i + 1], "amount": rng.randint(1, 50000),
+         "from_name": names[members[i]], "to_name": names[members[i + 1]]}
+        for i in range(member_count - 1)
+    ]
+    return {
+        "expenses": expenses,
+        "next_cursor": None,
+        "totals": {"total": sum(e["amount"] for e in expenses), "by_payer": {}},
+        "settlement": {"balances": balances, "payments": payments, "mode": "greedy"}
+    }
+
+def measure(func, repeat):
+    """回傳 (最佳耗時秒數, 結果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def serializers():
+    """(名稱, 函式) 列表，函式回傳 UTF-8 位元組"""
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    
+    provider = DefaultJSONProvider(Flask(__name__))
+    result = [
+        ("flask 預設", lambda obj: provider.dumps(obj).encode('utf-8')),
+        ("json 精簡", lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode('utf-8')),
+    ]
+    try:
+        import orjson
+        result.append(("orjson", orjson.dumps))
+    except ImportError:
+        print("未安裝 orjson，略過")
+    try:
+        import ujson
+        result.append(("ujson", lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8')))
+    except ImportError:
+        print("未安裝 ujson，略過")
+    return result
+
+def compressors():
+    """(名稱, 函式) 列表"""
+    def gzip_level(level):
+        def run(data):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        return run
+    
+    result = [(f"gzip -{level}", gzip_level(level)) for level in (1, 6, 9)]
+    try:
+        import brotli
+        result.extend(
+            (f"br q{quality}", lambda data, quality=quality: brotli.compress(data, quality=quality))
+            for quality in (1, 4, 6)
+        )
+    except ImportError:
+        print("未安裝 brotli，略過")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="比較大型支出回應的 JSON 序列化與壓縮成本")
+    parser.add_argument("--expenses", type=int, default=5000)
+    parser.add_argument("--members", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    payload = build_payload(args.expenses, args.members, args.seed)
+    print(f"合成回應：{args.expenses} 筆支出、{args.members} 位成員")
+    
+    print(f"\n{'序列化':>12} {'ms':>8} {'KB':>8} {'MB/s':>8}")
+    for name, func in serializers():
+        elapsed, data = measure(lambda: func(payload), args.repeat)
+        if json.loads(data) != payload:
+            print(f"{name:>12} 結果不一致！")
+            continue
+        print(f"{name:>12} {elapsed * 1000:8.2f} {len(data) / 1024:8.1f} {len(data) / elapsed / 1e6:8.1f}")
+    
+    # 壓縮精簡格式的輸出（與 encoding.py 的回應相同）
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    print(f"\n{'壓縮':>12} {'ms':>8} {'KB':>8} {'比例':>8}")
+    for name, func in compressors():
+        elapsed, data = measure(lambda: func(encoded), args.repeat)
+        print(f"{name:>12} {elapsed * 1000:8.2f} {len(data) / 1024:8.1f} {len(data) / len(encoded):8.1%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+OTP 寄信吞吐量比較：sync、pooled、queue 三種寄送方式
+
+用法：python bench/bench_mail.py [--requests 200] [--concurrency 20] [--modes sync,pooled,queue]
+      [--connect-delay-ms 300] [--send-delay-ms 20]
+
+每種模式各啟動一個應用程式子行程（多執行緒 WSGI 伺服器、暫存資料庫），
+郵件寄到本機 SMTP 接收端（smtp_sink.py），以延遲參數模擬 STARTTLS／登入與寄送的耗時。
+同時發出 N 個 /api/auth/send-otp 請求，回報：
+- HTTP 回應延遲百分位數
+- 端對端延遲（請求送出到接收端收到郵件）百分位數
+- 每秒寄出的郵件數
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def serve(port):
+    """子行程：在暫存目錄啟動應用程式"""
+    os.chdir(tempfile.mkdtemp(prefix="splitwise-bench-mail-"))
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from app import app
+    from database import init_db
+    
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+    
+    init_db()
+    make_server("127.0.0.1", port, app, threaded=True, request_handler=QuietHandler).serve_forever()
+
+def wait_for(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"應用程式未在 {timeout} 秒內啟動")
+
+def post_otp(port, email):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/api/auth/send-otp",
+        data=json.dumps({"email": email}).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+        return response.status
+
+def run_mode(mode, args, sink, sink_port, delivered):
+    app_port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "MAIL_DELIVERY": mode,
+        "SMTP_SINK": "1",
+        "SMTP_SINK_PORT": str(sink_port),
+        "MAIL_POLL_INTERVAL": "0.5",
+        # 所有請求來自同一個 IP，壓測時停用限流
+        "RATE_LIMIT_BACKEND": "none",
+    })
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(app_port)],
+        env=env, cwd=ROOT
+    )
+    try:
+        wait_for(app_port)
+        emails = [f"bench-{mode}-{i}@example.com" for i in range(args.requests)]
+        sent_at = {}
+        http_latency = []
+        failures = 0
+        
+        def one(email):
+            start = time.time()
+            sent_at[email] = start
+            try:
+                status = post_otp(app_port, email)
+            except Exception:
+                status = None
+            return status, time.time() - start
+        
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for status, elapsed in pool.map(one, emails):
+                http_latency.append(elapsed)
+                if status != 200:
+                    failures += 1
+        
+        # 等待全部郵件送達接收端
+        deadline = time.time() + args.timeout
+        while time.time() < deadline and not all(email in delivered for email in emails):
+            time.sleep(0.05)
+        received = [email for email in emails if email in delivered]
+        finished = max((delivered[email] for email in received), default=time.time())
+        
+        end_to_end = [delivered[email] - sent_at[email] for email in received]
+        return {
+            "mode": mode,
+            "http_p50": percentile(http_latency, 50),
+            "http_p95": percentile(http_latency, 95),
+            "http_p99": percentile(http_latency, 99),
+            "e2e_p50": percentile(end_to_end, 50),
+            "e2e_p95": percentile(end_to_end, 95),
+            "e2e_p99": percentile(end_to_end, 99),
+            "emails_per_second": len(received) / max(finished - start, 1e-9),
+            "delivered": len(received),
+            "failures": failures,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 OTP 寄信方式的吞吐量")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--modes", default="sync,pooled,queue")
+    parser.add_argument("--connect-delay-ms", type=float, default=300,
+                        help="模擬每條 SMTP 連線的握手時間（STARTTLS 與登入）")
+    parser.add_argument("--send-delay-ms", type=float, default=20, help="模擬每封郵件的寄送時間")
+    parser.add_argument("--timeout", type=float, default=120, help="等待郵件送達的秒數上限")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.serve)
+        return
+    
+    from smtp_sink import start_sink
+    
+    delivered = {}
+    
+    def on_message(received_at, sender, recipients, size):
+        for recipient in recipients:
+            delivered[recipient] = received_at
+    
+    sink_port = free_port()
+    sink = start_sink(
+        "127.0.0.1", sink_port,
+        connect_delay_ms=args.connect_delay_ms,
+        send_delay_ms=args.send_delay_ms,
+        on_message=on_message
+    )
+    
+    print(f"{args.requests} 個請求、並行 {args.concurrency}，"
+          f"SMTP 握手 {args.connect_delay_ms:.0f} ms、寄送 {args.send_delay_ms:.0f} ms")
+    print(f"{'mode':>8} {'http p50':>9} {'p95':>7} {'p99':>7} {'e2e p50':>9} {'p95':>7} {'p99':>7} "
+          f"{'mail/s':>8} {'delivered':>9} {'conns':>6}")
+    for mode in args.modes.split(","):
+        connections_before = sink.connections
+        result = run_mode(mode.strip(), args, sink, sink_port, delivered)
+        print(f"{result['mode']:>8} {result['http_p50']:9.3f} {result['http_p95']:7.3f} {result['http_p99']:7.3f} "
+              f"{result['e2e_p50']:9.3f} {result['e2e_p95']:7.3f} {result['e2e_p99']:7.3f} "
+              f"{result['emails_per_second']:8.1f} {result['delivered']:9d} {sink.connections - connections_before:6d}")
+        if result["failures"]:
+            print(f"  {result['failures']} 個請求失敗")
+    
+    sink.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+結算彙總效能比較：純 Python 迴圈、SQL 聚合、NumPy 向量化
+
+用法：python bench/bench_settlement.py [--expenses 50000] [--members 300] [--repeat 3]
+
+在暫存目錄建立合成房間，不會動到專案中的資料庫。未安裝 NumPy 時略過該項。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+def build_room(conn, expense_count, member_count, max_participants, seed):
+    """建立一個合成房間，回傳 room_id"""
+    rng = random.Random(seed)
+    members = [f"user{i}@example.com" for i in range(member_count)]
+    room_id = "bench-room"
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO rooms (id, name, owner_email) VALUES (?, ?, ?)",
+        (room_id, "bench", members[0])
+    )
+    cursor.executemany(
+        "INSERT INTO room_members (room_id, email) VALUES (?, ?)",
+        [(room_id, email) for email in members]
+    )
+    
+    for i in range(expense_count):
+        cursor.execute(
+            "INSERT INTO expenses (room_id, title, amount, payer_email) VALUES (?, ?, ?, ?)",
+            (room_id, f"expense {i}", rng.randint(1, 100000), rng.choice(members))
+        )
+        participants = rng.sample(members, rng.randint(1, min(max_participants, member_count)))
+        cursor.executemany(
+            "INSERT INTO expense_participants (expense_id, email) VALUES (?, ?)",
+            [(cursor.lastrowid, email) for email in participants]
+        )
+    
+    conn.commit()
+    return room_id
+
+def python_totals(cursor, room_id):
+    """逐筆支出以 dict 累加（對照組）"""
+    cursor.execute("SELECT id, amount, payer_email FROM expenses WHERE room_id=?", (room_id,))
+    expenses = cursor.fetchall()
+    
+    cursor.execute("""
+        SELECT ep.expense_id, ep.email
+        FROM expense_participants ep
+        JOIN expenses e ON e.id = ep.expense_id
+        WHERE e.room_id = ?
+    """, (room_id,))
+    participants_by_expense = {}
+    for expense_id, email in cursor.fetchall():
+        participants_by_expense.setdefault(expense_id, []).append(email)
+    
+    totals = {}
+    for expense_id, amount, payer_email in expenses:
+        participants = participants_by_expense.get(expense_id)
+        if not participants:
+            continue
+        
+        paid, share, refs = totals.get(payer_email, (0, 0, 0))
+        totals[payer_email] = (paid + amount, share, refs + 1)
+        
+        share_per_person = amount // len(participants)
+        for email in participants:
+            paid, share, refs = totals.get(email, (0, 0, 0))
+            totals[email] = (paid, share + share_per_person, refs + 1)
+    
+    return totals
+
+def measure(func, cursor, room_id, repeat):
+    """回傳 (最佳耗時秒數, 結果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(cursor, room_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="比較結算彙總的計算方式")
+    parser.add_argument("--expenses", type=int, default=50000)
+    parser.add_argument("--members", type=int, default=300)
+    parser.add_argument("--max-participants", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    os.chdir(tempfile.mkdtemp(prefix="splitwise-bench-"))
+    
+    import calculations
+    from database import connect, migrate
+    
+    conn = connect()
+    migrate(conn)
+    
+    print(f"建立合成房間：{args.expenses} 筆支出、{args.members} 位成員")
+    room_id = build_room(conn, args.expenses, args.members, args.max_participants, args.seed)
+    cursor = conn.cursor()
+    
+    paths = [
+        ("python", python_totals),
+        ("sql", calculations.compute_totals_sql),
+    ]
+    if calculations.np is not None:
+        paths.append(("numpy", calculations.compute_totals_numpy))
+    else:
+        print("未安裝 NumPy，略過 numpy")
+    
+    expected = None
+    for name, func in paths:
+        elapsed, result = measure(func, cursor, room_id, args.repeat)
+        if expected is None:
+            expected = result
+        status = "一致" if result == expected else "結果不一致！"
+        print(f"{name:>8}: {elapsed * 1000:9.1f} ms  {status}")
+    
+    conn.close()
+
+if __name__ == '__main__':
+    main()
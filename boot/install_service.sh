@@ -29,6 +29,7 @@ echo "服務管理命令："
 echo "  啟動服務: sudo systemctl start splitwise"
 echo "  停止服務: sudo systemctl stop splitwise"
 echo "  重啟服務: sudo systemctl restart splitwise"
+echo "  平滑重啟: sudo systemctl reload splitwise"
 echo "  查看狀態: sudo systemctl status splitwise"
 echo "  查看日誌: sudo journalctl -u splitwise -f"
 echo "  禁用開機啟動: sudo systemctl disable splitwise"
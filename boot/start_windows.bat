@@ -6,7 +6,7 @@ cd /d "%~dp0\.."
 
 REM 啟動虛擬環境並執行應用程式
 call venv\Scripts\activate.bat
-python src\app.py
+python src\wsgi.py
 
 pause
 
@@ -16,6 +16,6 @@ echo "Installing dependencies"
 pip install --upgrade pip
 pip install -r requirements.txt
 
-sudo rm splitwise.db
+sudo rm -f splitwise.db splitwise.db-wal splitwise.db-shm
 
 echo "Deploy complete"
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+gunicorn 設定檔
+
+啟動：gunicorn -c gunicorn.conf.py
+平滑重啟（載入新程式碼、不中斷進行中的請求）：kill -HUP <master pid> 或 systemctl reload splitwise
+
+所有設定都可用 ENV/.env 或環境變數調整。
+"""
+import os
+import subprocess
+import sys
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(ROOT, 'src')
+load_dotenv(os.path.join(ROOT, 'ENV', '.env'))
+
+wsgi_app = "wsgi:app"
+pythonpath = SRC
+# 資料庫檔案 splitwise.db 位於專案根目錄
+chdir = ROOT
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# SQLite 同一時間只有一個寫入者，worker 行程數不需太多；
+# 每個行程以多執行緒處理請求，執行緒數不應超過 DB_POOL_SIZE
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+
+# 閒置的 keep-alive 連線保留秒數；前面有 nginx 等反向代理時應大於代理的 keepalive_timeout
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+# 請求處理超過這個秒數的 worker 會被重啟（匯入大型檔案時可調高）
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+# 平滑重啟或停止時，等待進行中請求完成的秒數
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+
+# 每個 worker 處理這麼多請求後輪替，0 表示不輪替
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "0"))
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+errorlog = "-"
+
+# 設為 memory 時只在單一行程內有效的設定與其預設值；
+# 多個 worker 時未設定的改用 sqlite，明確設為 memory 則拒絕啟動
+PROCESS_LOCAL_SETTINGS = (
+    ("OTP_BACKEND", "sqlite"),
+    ("RATE_LIMIT_BACKEND", "memory"),
+)
+
+def _migrate(server):
+    """
+    以子行程執行資料庫遷移
+    
+    master 行程不 import 應用程式模組，平滑重啟時新的 worker 才會載入新版本的程式碼
+    """
+    subprocess.run([sys.executable, os.path.join(SRC, 'manage.py'), 'migrate'], cwd=ROOT, check=True)
+    server.log.info("資料庫遷移完成")
+
+def on_starting(server):
+    """master 行程啟動時執行一次資料庫遷移，之後才 fork worker"""
+    _migrate(server)
+    
+    if server.cfg.workers > 1:
+        for name, default in PROCESS_LOCAL_SETTINGS:
+            value = os.getenv(name)
+            if value is None and default == "memory":
+                # 應用程式在 worker 中載入，fork 前設定的環境變數會被繼承
+                os.environ[name] = "sqlite"
+                server.log.info("%d 個 worker，%s 預設改用 sqlite", server.cfg.workers, name)
+            elif value == "memory":
+                server.log.error(
+                    "%s=memory 只在單一行程內有效，%d 個 worker 之間不會共用；請改用 sqlite 或設定 WEB_WORKERS=1",
+                    name, server.cfg.workers
+                )
+                sys.exit(1)
+
+def on_reload(server):
+    """平滑重啟時先套用新版本的遷移，再啟動載入新程式碼的 worker"""
+    _migrate(server)
@@ -8,4 +8,5 @@ echo "Activating virtual environment"
 
 echo "Running application"
 
-python3 src/app.py
\ No newline at end of file
+# 開發時可改用 python3 src/app.py（單執行緒、自動重新載入）
+gunicorn -c gunicorn.conf.py
\ No newline at end of file
@@ -1,16 +1,27 @@
-from flask import Flask, request, jsonify, session, render_template, redirect, url_for, Response
+from flask import Flask, request, jsonify, session, render_template, redirect, url_for, Response, stream_with_context
 import os
 import csv
 import io
+import shutil
+import tempfile
+import zlib
 from datetime import datetime
 from urllib.parse import quote
 from dotenv import load_dotenv
+from werkzeug.http import quote_etag
 from werkzeug.middleware.proxy_fix import ProxyFix
-from database import init_db, get_db
-from models import generate_otp, save_otp, verify_otp, create_user, generate_room_id, update_user_name, get_user_name, get_user_names
-from mailer import send_otp_email
-from auth import login_required, is_admin, get_current_user, can_access_room, can_invite_to_room, ADMIN_EMAIL
-from calculations import calculate_settlement
+from database import init_db, get_db, init_app, get_pool, begin_immediate, backup_database, DB_NAME
+from encoding import init_encoding, encoding_stats, dumps
+from models import generate_otp, save_otp, verify_otp, create_user, generate_room_id, update_user_name, get_user_names, bump_room_version, get_room_version, parse_expense, get_member_set, check_expense_members, insert_expenses, iter_export_rows
+from models import ROOMS_QUERY, ALL_ROOMS_QUERY, DELETE_ROOM_PARTICIPANTS_QUERY, DELETE_ROOM_EXPENSES_QUERY, EXPENSE_EXISTS_QUERY, ALL_USERS_QUERY, PAYER_ROOMS_QUERY, DELETE_USER_MEMBERSHIPS_QUERY, DELETE_OWNED_ROOMS_QUERY, USER_EXISTS_QUERY, USER_NAME_QUERY, MEMBER_ROOMS_QUERY, DELETE_PAYER_PARTICIPANTS_QUERY, DELETE_USER_QUERY
+from mail_queue import deliver_otp, start_mail_worker, mail_stats
+from otp_store import start_otp_purger, otp_stats
+from ratelimit import check_auth_limit, rate_limiter
+from auth import login_required, is_admin, get_current_user, can_access_room, can_invite_to_room, invalidate_room_access, invalidate_admins, permission_cache, ADMIN_EMAIL, ADMINS_QUERY
+from importer import import_expenses, detect_format
+from room_views import user_info, room_detail, expense_listing, room_settlement, room_bootstrap, expense_change, variant_digest, etag_matches, CACHE_CONTROL
+from events import broker, RoomStream, iter_stream, parse_version, EVENTS_MAX_STREAMS, EVENTS_RETRY_MS
+from calculations import get_room_settlement, SETTLEMENT_MODES, invalidate_settlement, settlement_cache, apply_expense, apply_expenses, apply_stored_expense, rebuild_room_balances
 
 # 從 ENV/.env 載入環境變數
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ENV', '.env')
@@ -19,17 +30,53 @@ load_dotenv(env_path)
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 
+# 批次建立支出的筆數上限（分頁設定見 room_views.py）
+EXPENSES_MAX_BATCH = int(os.getenv("EXPENSES_MAX_BATCH", "500"))
+
 # 配置 ProxyFix 以處理 Cloudflare Tunnel 的反向代理
 # x_for=1: 信任 1 層 X-Forwarded-For 標頭
 # x_proto=1: 信任 X-Forwarded-Proto 標頭
 # x_host=1: 信任 X-Forwarded-Host 標頭
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
-# 初始化資料庫
-init_db()
+# 每個請求共用一條連線池連線，請求結束時歸還
+init_app(app)
+
+# JSON 序列化（orjson / ujson / 標準函式庫）與 /api/*、匯出路由的回應壓縮
+init_encoding(app)
+
+# 資料庫遷移在啟動時執行一次（gunicorn 由 gunicorn.conf.py 的 on_starting 執行），
+# 不在 import 時執行，避免每個 worker 行程各自遷移
+
+@app.before_request
+def ensure_background_workers():
+    """第一個請求進來時啟動背景寄信與 OTP 清除執行緒（在 worker 行程內啟動，避免 fork 前建立執行緒）"""
+    start_mail_worker()
+    start_otp_purger()
+
+def view_response(status, body, headers):
+    """將 room_views 的 (狀態碼, 內容, 標頭) 轉成 Flask 回應，304 不帶內容"""
+    if status == 304:
+        response = Response(status=304)
+    else:
+        response = jsonify(body)
+        response.status_code = status
+    response.headers.update(headers)
+    response.vary.add('Cookie')
+    return response
 
 # ==================== 認證相關路由 ====================
 
+def rate_limited(action, email):
+    """驗證路由依 IP 與 email 限流，超過時回傳 429 回應，未超過回傳 None"""
+    retry_after = check_auth_limit(action, request.remote_addr, email)
+    if not retry_after:
+        return None
+    
+    response = jsonify({"error": f"請求過於頻繁，請 {retry_after} 秒後再試"})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
 @app.route('/')
 def index():
     """首頁重定向到登入頁"""
@@ -62,16 +109,24 @@ def send_otp():
     if not email or '@' not in email:
         return jsonify({"error": "請輸入有效的 email"}), 400
     
+    limited = rate_limited("otp_send", email)
+    if limited:
+        return limited
+    
     # 生成並儲存 OTP
     otp = generate_otp()
     save_otp(email, otp)
     
-    # 發送郵件
+    # 發送郵件（queue 模式只寫入寄送佇列，由背景執行緒寄出）
     try:
-        send_otp_email(email, otp)
+        sent = deliver_otp(email, otp)
     except Exception as e:
         return jsonify({"error": f"發送郵件失敗: {str(e)}"}), 500
     
+    # sync 與 pooled 模式寄送失敗（包含等不到 SMTP 連線）時不回報已發送
+    if not sent:
+        return jsonify({"error": "發送郵件失敗，請稍後再試"}), 503
+    
     # 儲存待驗證的 email 到 session
     session['pending_email'] = email
     
@@ -85,16 +140,24 @@ def resend_otp():
     
     email = session['pending_email']
     
+    limited = rate_limited("otp_send", email)
+    if limited:
+        return limited
+    
     # 生成並儲存 OTP
     otp = generate_otp()
     save_otp(email, otp)
     
-    # 發送郵件
+    # 發送郵件（queue 模式只寫入寄送佇列，由背景執行緒寄出）
     try:
-        send_otp_email(email, otp)
+        sent = deliver_otp(email, otp)
     except Exception as e:
         return jsonify({"error": f"發送郵件失敗: {str(e)}"}), 500
     
+    # sync 與 pooled 模式寄送失敗（包含等不到 SMTP 連線）時不回報已發送
+    if not sent:
+        return jsonify({"error": "發送郵件失敗，請稍後再試"}), 503
+    
     return jsonify({"message": "驗證碼已重新發送"})
 
 @app.route('/api/auth/verify-otp', methods=['POST'])
@@ -110,6 +173,10 @@ def verify_otp_endpoint():
     if not otp or len(otp) != 6 or not otp.isdigit():
         return jsonify({"error": "請輸入 6 位數字驗證碼"}), 400
     
+    limited = rate_limited("otp_verify", email)
+    if limited:
+        return limited
+    
     # 驗證 OTP
     if not verify_otp(email, otp):
         return jsonify({"error": "驗證碼錯誤或已過期"}), 400
@@ -117,9 +184,8 @@ def verify_otp_endpoint():
     # 檢查使用者是否已存在且有名稱
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT name FROM users WHERE email=?", (email,))
+    cursor.execute(USER_NAME_QUERY, (email,))
     user = cursor.fetchone()
-    conn.close()
     
     if user:
         # 使用者已存在，檢查是否有名稱
@@ -167,14 +233,8 @@ def set_user_name():
 @login_required
 def get_current_user_info():
     """取得當前使用者資訊"""
-    email = get_current_user()
-    is_admin_user = is_admin(email)
-    name = get_user_name(email)
-    return jsonify({
-        "email": email,
-        "name": name,
-        "is_admin": is_admin_user
-    })
+    status, body = user_info(get_current_user())
+    return jsonify(body), status
 
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
@@ -194,25 +254,24 @@ def get_rooms():
     
     if is_admin(email):
         # 管理員可以看到所有房間
-        cursor.execute("SELECT id, name, owner_email, created_at FROM rooms ORDER BY created_at DESC")
+        cursor.execute(ALL_ROOMS_QUERY)
     else:
         # 一般使用者只能看到自己擁有或參與的房間
-        cursor.execute("""
-            SELECT DISTINCT r.id, r.name, r.owner_email, r.created_at
-            FROM rooms r
-            LEFT JOIN room_members rm ON r.id = rm.room_id
-            WHERE r.owner_email = ? OR rm.email = ?
-            ORDER BY r.created_at DESC
-        """, (email, email))
+        cursor.execute(ROOMS_QUERY, (email, email))
     
     rooms = cursor.fetchall()
     
+    # 列表內容只會隨房間增減或房間版本號（成員、擁有者名稱）改變，
+    # 未改變時回傳 304，省略名稱查詢與序列化
+    etag = "rooms." + variant_digest([(room[0], room[4]) for room in rooms])
+    headers = {"ETag": quote_etag(etag), "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return view_response(304, None, headers)
+    
     # 取得所有擁有者的名稱
     owner_emails = [room[2] for room in rooms]
     owner_names = get_user_names(owner_emails)
     
-    conn.close()
-    
     result = []
     for room in rooms:
         result.append({
@@ -223,7 +282,7 @@ def get_rooms():
             "created_at": room[3]
         })
     
-    return jsonify({"rooms": result})
+    return view_response(200, {"rooms": result}, headers)
 
 @app.route('/api/rooms', methods=['POST'])
 @login_required
@@ -242,7 +301,7 @@ def create_room():
     
     # 建立房間
     cursor.execute(
-        "INSERT INTO rooms (id, name, owner_email) VALUES (?, ?, ?)",
+        "INSERT INTO rooms (id, name, owner_email, updated_at) VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
         (room_id, name, email)
     )
     
@@ -253,7 +312,7 @@ def create_room():
     )
     
     conn.commit()
-    conn.close()
+    invalidate_room_access(room_id)
     
     return jsonify({"message": "房間建立成功", "room_id": room_id})
 
@@ -261,42 +320,20 @@ def create_room():
 @login_required
 def get_room(room_id):
     """取得房間詳細資訊"""
-    email = get_current_user()
-    
-    if not can_access_room(email, room_id):
-        return jsonify({"error": "無權限存取此房間"}), 403
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # 取得房間資訊
-    cursor.execute("SELECT id, name, owner_email, created_at FROM rooms WHERE id=?", (room_id,))
-    room = cursor.fetchone()
-    
-    if not room:
-        conn.close()
-        return jsonify({"error": "房間不存在"}), 404
-    
-    # 取得房間成員
-    cursor.execute("SELECT email FROM room_members WHERE room_id=?", (room_id,))
-    members = cursor.fetchall()
-    member_emails = [member[0] for member in members]
-    
-    # 取得所有成員的名稱
-    member_names = get_user_names(member_emails)
-    owner_name = get_user_name(room[2])
-    
-    conn.close()
-    
-    return jsonify({
-        "id": room[0],
-        "name": room[1],
-        "owner_email": room[2],
-        "owner_name": owner_name,
-        "created_at": room[3],
-        "members": member_emails,
-        "member_names": member_names
-    })
+    return view_response(*room_detail(get_current_user(), room_id, request.headers.get('If-None-Match')))
+
+@app.route('/api/rooms/<room_id>/bootstrap', methods=['GET'])
+@login_required
+def get_room_bootstrap(room_id):
+    """
+    房間頁面開啟時一次取得使用者、房間、第一頁支出與結算
+    
+    查詢參數：
+    - mode：結算模式（預設 greedy）
+    """
+    return view_response(*room_bootstrap(
+        get_current_user(), room_id, request.args.get('mode'), request.headers.get('If-None-Match')
+    ))
 
 @app.route('/api/rooms/<room_id>', methods=['DELETE'])
 @login_required
@@ -312,23 +349,19 @@ def delete_room(room_id):
     room = cursor.fetchone()
     
     if not room:
-        conn.close()
         return jsonify({"error": "房間不存在"}), 404
     
     # 檢查權限：只有擁有者或管理員可以刪除
     if room[0] != email and not is_admin(email):
-        conn.close()
         return jsonify({"error": "無權限刪除此房間"}), 403
     
     # 刪除相關資料
     # 1. 刪除支出參與者
-    cursor.execute("""
-        DELETE FROM expense_participants 
-        WHERE expense_id IN (SELECT id FROM expenses WHERE room_id=?)
-    """, (room_id,))
+    cursor.execute(DELETE_ROOM_PARTICIPANTS_QUERY, (room_id,))
     
-    # 2. 刪除支出
-    cursor.execute("DELETE FROM expenses WHERE room_id=?", (room_id,))
+    # 2. 刪除支出與餘額彙總
+    cursor.execute(DELETE_ROOM_EXPENSES_QUERY, (room_id,))
+    cursor.execute("DELETE FROM room_balances WHERE room_id=?", (room_id,))
     
     # 3. 刪除房間成員
     cursor.execute("DELETE FROM room_members WHERE room_id=?", (room_id,))
@@ -337,7 +370,9 @@ def delete_room(room_id):
     cursor.execute("DELETE FROM rooms WHERE id=?", (room_id,))
     
     conn.commit()
-    conn.close()
+    invalidate_settlement(room_id)
+    invalidate_room_access(room_id)
+    broker.publish(room_id, None, "room_deleted", {})
     
     return jsonify({"message": "房間已刪除"})
 
@@ -365,7 +400,6 @@ def invite_to_room(room_id):
     # 檢查房間是否存在
     cursor.execute("SELECT id FROM rooms WHERE id=?", (room_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "房間不存在"}), 404
     
     # 檢查是否已經是成員
@@ -374,11 +408,10 @@ def invite_to_room(room_id):
         (room_id, invite_email)
     )
     if cursor.fetchone():
-        conn.close()
         return jsonify({"error": "該使用者已經是房間成員"}), 400
     
     # 如果使用者不存在，建立使用者記錄（verified=0）
-    cursor.execute("SELECT email FROM users WHERE email=?", (invite_email,))
+    cursor.execute(USER_EXISTS_QUERY, (invite_email,))
     if not cursor.fetchone():
         cursor.execute(
             "INSERT INTO users (email, verified) VALUES (?, ?)",
@@ -390,151 +423,140 @@ def invite_to_room(room_id):
         "INSERT INTO room_members (room_id, email) VALUES (?, ?)",
         (room_id, invite_email)
     )
+    version = bump_room_version(cursor, room_id)
     
     conn.commit()
-    conn.close()
+    invalidate_room_access(room_id)
+    broker.publish(room_id, version, "room_updated", {"version": version})
     
-    return jsonify({"message": "邀請成功"})
+    return jsonify({"message": "邀請成功", "version": version})
 
 # ==================== 支出相關 API ====================
 
 @app.route('/api/rooms/<room_id>/expenses', methods=['GET'])
 @login_required
 def get_expenses(room_id):
-    """取得房間的所有支出"""
+    """
+    分頁取得房間的支出
+    
+    查詢參數：
+    - limit：每頁筆數（預設 EXPENSES_PAGE_SIZE）
+    - cursor：上一頁回傳的 next_cursor
+    第一頁（沒有 cursor）另外附上 totals 供消費統計使用
+    """
+    return view_response(*expense_listing(
+        get_current_user(), room_id, request.args.get('limit'), request.args.get('cursor'),
+        request.headers.get('If-None-Match')
+    ))
+
+@app.route('/api/rooms/<room_id>/expenses', methods=['POST'])
+@login_required
+def create_expense(room_id):
+    """建立新支出"""
     email = get_current_user()
     
     if not can_access_room(email, room_id):
         return jsonify({"error": "無權限存取此房間"}), 403
     
+    expense, error = parse_expense(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+    
     conn = get_db()
     cursor = conn.cursor()
     
-    # 取得所有支出
-    cursor.execute(
-        "SELECT id, title, amount, payer_email, created_at FROM expenses WHERE room_id=? ORDER BY created_at DESC",
-        (room_id,)
-    )
-    expenses = cursor.fetchall()
+    # 以單一查詢檢查付款人與參與者是否都是房間成員
+    members = get_member_set(cursor, room_id, [expense["payer"]] + expense["participants"])
+    error = check_expense_members(expense, members)
+    if error:
+        return jsonify({"error": error}), 400
     
-    # 收集所有需要查詢名稱的 email
-    all_emails = set()
-    for expense in expenses:
-        all_emails.add(expense[3])  # payer_email
-        expense_id = expense[0]
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        all_emails.update(participants)
+    # 建立支出與參與者
+    begin_immediate(conn)
+    expense_id = insert_expenses(cursor, room_id, [expense])[0]
     
-    # 取得所有用戶名稱
-    user_names = get_user_names(list(all_emails))
+    # 更新餘額彙總表
+    apply_expense(cursor, room_id, expense["amount"], expense["payer"], expense["participants"])
+    version = bump_room_version(cursor, room_id)
     
-    result = []
-    for expense in expenses:
-        expense_id = expense[0]
-        
-        # 取得參與者
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        
-        result.append({
-            "id": expense_id,
-            "title": expense[1],
-            "amount": expense[2],
-            "payer_email": expense[3],
-            "payer_name": user_names.get(expense[3], expense[3]),
-            "created_at": expense[4],
-            "participants": participants,
-            "participant_names": {email: user_names.get(email, email) for email in participants}
-        })
-    
-    conn.close()
+    conn.commit()
+    publish_expense_change(room_id, version, "expense_added", expense_id)
     
-    return jsonify({"expenses": result})
+    return jsonify({"message": "支出建立成功", "expense_id": expense_id, "version": version})
 
-@app.route('/api/rooms/<room_id>/expenses', methods=['POST'])
+@app.route('/api/rooms/<room_id>/expenses:batch', methods=['POST'])
 @login_required
-def create_expense(room_id):
-    """建立新支出"""
+def create_expenses_batch(room_id):
+    """
+    批次建立支出
+    
+    請求格式：{"expenses": [{"title", "amount", "payer", "participants"}, ...]}
+    所有項目以一次成員查詢驗證，通過驗證的項目在同一個交易內寫入；
+    回傳每個項目的結果 {"index", "expense_id"} 或 {"index", "error"}
+    """
     email = get_current_user()
     
     if not can_access_room(email, room_id):
         return jsonify({"error": "無權限存取此房間"}), 403
     
-    data = request.get_json()
-    title = data.get('title', '').strip()
-    amount = data.get('amount', 0)
-    payer = data.get('payer', '').strip().lower()
-    participants = data.get('participants', [])
-    
-    if not title:
-        return jsonify({"error": "支出標題不能為空"}), 400
-    
-    if amount <= 0:
-        return jsonify({"error": "支出金額必須大於 0"}), 400
+    data = request.get_json(silent=True) or {}
+    items = data.get('expenses') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "請提供支出列表"}), 400
     
-    if not payer or '@' not in payer:
-        return jsonify({"error": "請輸入有效的付款人 email"}), 400
+    if len(items) > EXPENSES_MAX_BATCH:
+        return jsonify({"error": f"單次最多建立 {EXPENSES_MAX_BATCH} 筆支出"}), 400
     
-    if not participants or len(participants) == 0:
-        return jsonify({"error": "至少需要一個參與者"}), 400
-    
-    # 轉換 participants 為小寫
-    participants = [p.strip().lower() for p in participants]
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        expense, error = parse_expense(item)
+        if error:
+            results[index] = {"index": index, "error": error}
+        else:
+            parsed.append((index, expense))
     
     conn = get_db()
     cursor = conn.cursor()
     
-    # 檢查付款人是否是房間成員
-    cursor.execute(
-        "SELECT email FROM room_members WHERE room_id=? AND email=?",
-        (room_id, payer)
-    )
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({"error": "付款人必須是房間成員"}), 400
-    
-    # 檢查所有參與者是否都是房間成員
-    # 使用參數化查詢，避免 SQL injection
-    if len(participants) == 0:
-        conn.close()
-        return jsonify({"error": "至少需要一個參與者"}), 400
-    
-    # 建立參數化查詢
-    placeholders = ','.join(['?'] * len(participants))
-    query = "SELECT email FROM room_members WHERE room_id=? AND email IN (" + placeholders + ")"
-    params = (room_id,) + tuple(participants)
-    cursor.execute(query, params)
-    valid_members = {row[0] for row in cursor.fetchall()}
-    
-    if len(valid_members) != len(participants):
-        conn.close()
-        return jsonify({"error": "所有參與者必須是房間成員"}), 400
-    
-    # 建立支出
-    cursor.execute(
-        "INSERT INTO expenses (room_id, title, amount, payer_email) VALUES (?, ?, ?, ?)",
-        (room_id, title, amount, payer)
-    )
-    expense_id = cursor.lastrowid
-    
-    # 加入參與者
-    for participant_email in participants:
-        cursor.execute(
-            "INSERT INTO expense_participants (expense_id, email) VALUES (?, ?)",
-            (expense_id, participant_email)
-        )
-    
-    conn.commit()
-    conn.close()
+    # 整批只查詢一次房間成員
+    emails = []
+    for _, expense in parsed:
+        emails.append(expense["payer"])
+        emails.extend(expense["participants"])
+    members = get_member_set(cursor, room_id, emails)
+    
+    valid = []
+    for index, expense in parsed:
+        error = check_expense_members(expense, members)
+        if error:
+            results[index] = {"index": index, "error": error}
+        else:
+            valid.append((index, expense))
     
-    return jsonify({"message": "支出建立成功", "expense_id": expense_id})
+    if valid:
+        begin_immediate(conn)
+        expense_ids = insert_expenses(cursor, room_id, [expense for _, expense in valid])
+        
+        # 更新餘額彙總表（整批合併為每人一列）
+        apply_expenses(cursor, room_id, [
+            (expense["amount"], expense["payer"], expense["participants"])
+            for _, expense in valid
+        ])
+        version = bump_room_version(cursor, room_id)
+        
+        conn.commit()
+        broker.publish(room_id, version, "reset", {"version": version})
+        
+        for (index, _), expense_id in zip(valid, expense_ids):
+            results[index] = {"index": index, "expense_id": expense_id}
+    
+    response = {
+        "created": len(valid),
+        "failed": len(items) - len(valid),
+        "results": results
+    }
+    return jsonify(response), 200 if valid else 400
 
 @app.route('/api/rooms/<room_id>/expenses/<expense_id>', methods=['PUT'])
 @login_required
@@ -546,62 +568,34 @@ def update_expense(room_id, expense_id):
     if not can_access_room(email, room_id):
         return jsonify({"error": "無權限存取此房間"}), 403
     
-    data = request.get_json()
-    title = data.get('title', '').strip()
-    amount = data.get('amount', 0)
-    payer = data.get('payer', '').strip().lower()
-    participants = data.get('participants', [])
-    
-    if not title:
-        return jsonify({"error": "支出標題不能為空"}), 400
-    
-    if amount <= 0:
-        return jsonify({"error": "支出金額必須大於 0"}), 400
-    
-    if not payer or '@' not in payer:
-        return jsonify({"error": "請輸入有效的付款人 email"}), 400
-    
-    if not participants or len(participants) == 0:
-        return jsonify({"error": "至少需要一個參與者"}), 400
-    
-    # 轉換 participants 為小寫
-    participants = [p.strip().lower() for p in participants]
+    expense, error = parse_expense(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
     
     conn = get_db()
     cursor = conn.cursor()
     
-    # 檢查支出是否存在
-    cursor.execute(
-        "SELECT id FROM expenses WHERE id=? AND room_id=?",
-        (expense_id, room_id)
-    )
+    # 先取得寫入鎖再確認支出存在，避免同時的更新或刪除重複扣除餘額
+    begin_immediate(conn)
+    cursor.execute(EXPENSE_EXISTS_QUERY, (expense_id, room_id))
     if not cursor.fetchone():
-        conn.close()
+        conn.rollback()
         return jsonify({"error": "支出記錄不存在"}), 404
     
-    # 檢查付款人是否是房間成員
-    cursor.execute(
-        "SELECT email FROM room_members WHERE room_id=? AND email=?",
-        (room_id, payer)
-    )
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({"error": "付款人必須是房間成員"}), 400
-    
-    # 檢查所有參與者是否都是房間成員
-    if len(participants) == 0:
-        conn.close()
-        return jsonify({"error": "至少需要一個參與者"}), 400
+    # 以單一查詢檢查付款人與參與者是否都是房間成員
+    members = get_member_set(cursor, room_id, [expense["payer"]] + expense["participants"])
+    error = check_expense_members(expense, members)
+    if error:
+        conn.rollback()
+        return jsonify({"error": error}), 400
     
-    placeholders = ','.join(['?'] * len(participants))
-    query = "SELECT email FROM room_members WHERE room_id=? AND email IN (" + placeholders + ")"
-    params = (room_id,) + tuple(participants)
-    cursor.execute(query, params)
-    valid_members = {row[0] for row in cursor.fetchall()}
+    title = expense["title"]
+    amount = expense["amount"]
+    payer = expense["payer"]
+    participants = expense["participants"]
     
-    if len(valid_members) != len(participants):
-        conn.close()
-        return jsonify({"error": "所有參與者必須是房間成員"}), 400
+    # 先從餘額彙總表扣除舊的支出內容
+    apply_stored_expense(cursor, expense_id)
     
     # 更新支出
     cursor.execute(
@@ -613,16 +607,19 @@ def update_expense(room_id, expense_id):
     cursor.execute("DELETE FROM expense_participants WHERE expense_id=?", (expense_id,))
     
     # 加入新的參與者
-    for participant_email in participants:
-        cursor.execute(
-            "INSERT INTO expense_participants (expense_id, email) VALUES (?, ?)",
-            (expense_id, participant_email)
-        )
+    cursor.executemany(
+        "INSERT INTO expense_participants (expense_id, email) VALUES (?, ?)",
+        [(expense_id, participant_email) for participant_email in participants]
+    )
+    
+    # 加入新的支出內容
+    apply_expense(cursor, room_id, amount, payer, participants)
+    version = bump_room_version(cursor, room_id)
     
     conn.commit()
-    conn.close()
+    publish_expense_change(room_id, version, "expense_updated", int(expense_id))
     
-    return jsonify({"message": "支出記錄已更新"})
+    return jsonify({"message": "支出記錄已更新", "version": version})
 
 @app.route('/api/rooms/<room_id>/expenses/<expense_id>', methods=['DELETE'])
 @login_required
@@ -637,65 +634,128 @@ def delete_expense(room_id, expense_id):
     conn = get_db()
     cursor = conn.cursor()
     
-    # 檢查支出是否存在
-    cursor.execute(
-        "SELECT id FROM expenses WHERE id=? AND room_id=?",
-        (expense_id, room_id)
-    )
+    # 先取得寫入鎖再確認支出存在，避免同時的更新或刪除重複扣除餘額
+    begin_immediate(conn)
+    cursor.execute(EXPENSE_EXISTS_QUERY, (expense_id, room_id))
     if not cursor.fetchone():
-        conn.close()
+        conn.rollback()
         return jsonify({"error": "支出記錄不存在"}), 404
     
+    # 從餘額彙總表扣除
+    apply_stored_expense(cursor, expense_id)
+    
     # 刪除支出參與者
     cursor.execute("DELETE FROM expense_participants WHERE expense_id=?", (expense_id,))
     
     # 刪除支出
     cursor.execute("DELETE FROM expenses WHERE id=?", (expense_id,))
+    version = bump_room_version(cursor, room_id)
     
     conn.commit()
-    conn.close()
+    publish_expense_change(room_id, version, "expense_deleted", int(expense_id))
     
-    return jsonify({"message": "支出記錄已刪除"})
+    return jsonify({"message": "支出記錄已刪除", "version": version})
 
-# ==================== 結算相關 API ====================
+def publish_expense_change(room_id, version, event_type, expense_id):
+    """支出變更 commit 後推送給房間的事件串流（沒有訂閱者時不做任何查詢）"""
+    if not broker.has_subscribers(room_id):
+        return
+    broker.publish(room_id, version, event_type, expense_change(room_id, version, event_type, expense_id))
 
-@app.route('/api/rooms/<room_id>/settlement', methods=['GET'])
+# ==================== 即時更新 ====================
+
+@app.route('/api/rooms/<room_id>/events', methods=['GET'])
 @login_required
-def get_settlement(room_id):
-    """取得房間的結算結果"""
+def room_events(room_id):
+    """
+    房間變更的事件串流（text/event-stream），格式見 events.py
+    
+    以 Last-Event-ID 標頭或 since 查詢參數指定頁面目前的版本號，
+    版本不同時先送出 reset。每條串流占用一條 worker 執行緒，
+    每個行程最多 EVENTS_MAX_STREAMS 條，超過時回傳 503
+    """
     email = get_current_user()
     
     if not can_access_room(email, room_id):
         return jsonify({"error": "無權限存取此房間"}), 403
     
-    result = calculate_settlement(room_id)
-    
-    # 取得所有用戶的名稱
-    all_emails = set()
-    for balance in result.get("balances", []):
-        all_emails.add(balance["email"])
-    for payment in result.get("payments", []):
-        all_emails.add(payment["from"])
-        all_emails.add(payment["to"])
-    
-    user_names = get_user_names(list(all_emails))
-    
-    # 添加名稱到結果中
-    for balance in result.get("balances", []):
-        balance["name"] = user_names.get(balance["email"], balance["email"])
+    subscription = broker.subscribe(room_id, limit=EVENTS_MAX_STREAMS)
+    if subscription is None:
+        response = jsonify({"error": "即時更新連線已滿"})
+        response.headers['Retry-After'] = str(EVENTS_RETRY_MS // 1000)
+        return response, 503
+    
+    since = parse_version(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    stream = RoomStream(email, room_id, since)
+    
+    # 不使用 stream_with_context：請求結束時歸還連線池的連線，串流期間改用執行緒專屬連線
+    def generate():
+        try:
+            yield from iter_stream(stream, subscription)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# ==================== 結算相關 API ====================
+
+@app.route('/api/rooms/<room_id>/settlement', methods=['GET'])
+@login_required
+def get_settlement(room_id):
+    """取得房間的結算結果"""
+    return view_response(*room_settlement(
+        get_current_user(), room_id, request.args.get('mode'), request.headers.get('If-None-Match')
+    ))
+
+# ==================== 匯出相關 API ====================
+
+def stream_csv(sections, flush_size=64 * 1024):
+    """
+    將多段 CSV 列串流輸出
     
-    for payment in result.get("payments", []):
-        payment["from_name"] = user_names.get(payment["from"], payment["from"])
-        payment["to_name"] = user_names.get(payment["to"], payment["to"])
+    sections 為可迭代的列集合，依序寫出；緩衝區超過 flush_size 時送出一個區塊，
+    第一個區塊（BOM 與標題）會立即送出
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     
-    return jsonify(result)
+    # 寫入 BOM（支援 Excel 正確顯示中文）
+    buffer.write('\ufeff')
+    
+    for rows in sections:
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= flush_size:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        # 每段結束時送出，讓標題不必等到第一批資料
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
 
-# ==================== 匯出相關 API ====================
+def csv_response(chunks, prefix, room_name):
+    """建立 CSV 下載回應（使用時間戳記避免中文檔名問題）"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_filename = f"{prefix}_{timestamp}.csv"
+    utf8_filename = f"{prefix}_{room_name}_{timestamp}.csv"
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype='text/csv; charset=utf-8-sig',
+        headers={
+            'Content-Disposition': f'attachment; filename="{safe_filename}"; filename*=UTF-8\'\'{quote(utf8_filename)}'
+        }
+    )
 
 @app.route('/api/rooms/<room_id>/export/expenses', methods=['GET'])
 @login_required
 def export_expenses(room_id):
-    """匯出支出記錄為 CSV"""
+    """匯出支出記錄為 CSV（串流輸出）"""
     email = get_current_user()
     
     if not can_access_room(email, room_id):
@@ -708,94 +768,24 @@ def export_expenses(room_id):
     cursor.execute("SELECT name FROM rooms WHERE id=?", (room_id,))
     room = cursor.fetchone()
     if not room:
-        conn.close()
         return jsonify({"error": "房間不存在"}), 404
     room_name = room[0]
     
-    # 取得所有支出
-    cursor.execute(
-        "SELECT id, title, amount, payer_email, created_at FROM expenses WHERE room_id=? ORDER BY created_at DESC",
-        (room_id,)
-    )
-    expenses = cursor.fetchall()
+    header = [
+        ['房間名稱', room_name],
+        ['匯出時間', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+        [],
+        ['支出記錄'],
+        ['日期', '標題', '金額', '付款人', '參與者']
+    ]
     
-    # 收集所有需要查詢名稱的 email
-    all_emails = set()
-    for expense in expenses:
-        all_emails.add(expense[3])  # payer_email
-        expense_id = expense[0]
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        all_emails.update(participants)
-    
-    # 取得所有用戶名稱
-    user_names = get_user_names(list(all_emails))
-    
-    # 建立 CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # 寫入 BOM（支援 Excel 正確顯示中文）
-    output.write('\ufeff')
-    
-    # 寫入標題
-    writer.writerow(['房間名稱', room_name])
-    writer.writerow(['匯出時間', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow([])
-    writer.writerow(['支出記錄'])
-    writer.writerow(['日期', '標題', '金額', '付款人', '參與者'])
-    
-    # 寫入支出記錄
-    for expense in expenses:
-        expense_id = expense[0]
-        title = expense[1]
-        amount = expense[2]
-        payer_email = expense[3]
-        created_at = expense[4]
-        
-        # 取得參與者
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        participant_names = [user_names.get(p, p) for p in participants]
-        
-        payer_name = user_names.get(payer_email, payer_email)
-        participants_str = ', '.join(participant_names)
-        
-        writer.writerow([
-            created_at,
-            title,
-            amount,
-            payer_name,
-            participants_str
-        ])
-    
-    conn.close()
-    
-    # 建立檔案名稱（使用時間戳記避免中文問題）
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_filename = f"expenses_{timestamp}.csv"
-    utf8_filename = f"expenses_{room_name}_{timestamp}.csv"
-    
-    # 建立回應
-    response = Response(
-        output.getvalue().encode('utf-8-sig'),
-        mimetype='text/csv; charset=utf-8-sig',
-        headers={
-            'Content-Disposition': f'attachment; filename="{safe_filename}"; filename*=UTF-8\'\'{quote(utf8_filename)}'
-        }
-    )
-    return response
+    chunks = stream_csv([header, iter_export_rows(room_id)])
+    return csv_response(chunks, "expenses", room_name)
 
 @app.route('/api/rooms/<room_id>/export/settlement', methods=['GET'])
 @login_required
 def export_settlement(room_id):
-    """匯出結算結果為 CSV（包含消費記錄）"""
+    """匯出結算結果為 CSV（包含消費記錄，串流輸出）"""
     email = get_current_user()
     
     if not can_access_room(email, room_id):
@@ -804,134 +794,106 @@ def export_settlement(room_id):
     conn = get_db()
     cursor = conn.cursor()
     
+    mode = request.args.get('mode', 'greedy')
+    if mode not in SETTLEMENT_MODES:
+        return jsonify({"error": "不支援的結算模式"}), 400
+    
     # 取得房間資訊
     cursor.execute("SELECT name FROM rooms WHERE id=?", (room_id,))
     room = cursor.fetchone()
     if not room:
-        conn.close()
         return jsonify({"error": "房間不存在"}), 404
     room_name = room[0]
     
-    # 取得結算結果
-    result = calculate_settlement(room_id)
+    # 取得結算結果（只和成員數量有關，可以先算好）
+    result = get_room_settlement(room_id, mode)
     
-    # 取得所有支出記錄
-    cursor.execute(
-        "SELECT id, title, amount, payer_email, created_at FROM expenses WHERE room_id=? ORDER BY created_at DESC",
-        (room_id,)
-    )
-    expenses = cursor.fetchall()
-    
-    # 收集所有需要查詢名稱的 email
     all_emails = set()
     for balance in result.get("balances", []):
         all_emails.add(balance["email"])
     for payment in result.get("payments", []):
         all_emails.add(payment["from"])
         all_emails.add(payment["to"])
-    for expense in expenses:
-        all_emails.add(expense[3])  # payer_email
-        expense_id = expense[0]
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        all_emails.update(participants)
     
     user_names = get_user_names(list(all_emails))
     
-    # 添加名稱到結果中
-    for balance in result.get("balances", []):
-        balance["name"] = user_names.get(balance["email"], balance["email"])
-    
-    for payment in result.get("payments", []):
-        payment["from_name"] = user_names.get(payment["from"], payment["from"])
-        payment["to_name"] = user_names.get(payment["to"], payment["to"])
-    
-    conn.close()
-    
-    # 建立 CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # 寫入 BOM（支援 Excel 正確顯示中文）
-    output.write('\ufeff')
-    
-    # 寫入標題
-    writer.writerow(['房間名稱', room_name])
-    writer.writerow(['匯出時間', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow([])
-    
-    # 寫入消費記錄
-    writer.writerow(['消費記錄'])
-    writer.writerow(['日期', '標題', '金額', '付款人', '參與者'])
-    for expense in expenses:
-        expense_id = expense[0]
-        title = expense[1]
-        amount = expense[2]
-        payer_email = expense[3]
-        created_at = expense[4]
-        
-        # 取得參與者
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = [p[0] for p in cursor.fetchall()]
-        conn.close()
-        
-        participant_names = [user_names.get(p, p) for p in participants]
-        payer_name = user_names.get(payer_email, payer_email)
-        participants_str = ', '.join(participant_names)
-        
-        writer.writerow([
-            created_at,
-            title,
-            amount,
-            payer_name,
-            participants_str
-        ])
-    
-    writer.writerow([])
+    header = [
+        ['房間名稱', room_name],
+        ['匯出時間', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+        [],
+        ['消費記錄'],
+        ['日期', '標題', '金額', '付款人', '參與者']
+    ]
     
     # 寫入餘額
-    writer.writerow(['每人餘額'])
-    writer.writerow(['用戶', '餘額'])
+    balances = [[], ['每人餘額'], ['用戶', '餘額']]
     for balance in result.get("balances", []):
-        writer.writerow([
-            balance["name"],
+        balances.append([
+            user_names.get(balance["email"], balance["email"]),
             balance["balance"]
         ])
     
-    writer.writerow([])
-    
     # 寫入付款建議
-    writer.writerow(['付款建議'])
-    writer.writerow(['付款人', '收款人', '金額'])
+    payments = [[], ['付款建議'], ['付款人', '收款人', '金額']]
     for payment in result.get("payments", []):
-        writer.writerow([
-            payment["from_name"],
-            payment["to_name"],
+        payments.append([
+            user_names.get(payment["from"], payment["from"]),
+            user_names.get(payment["to"], payment["to"]),
             payment["amount"]
         ])
     
-    # 建立檔案名稱（使用時間戳記避免中文問題）
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_filename = f"settlement_{timestamp}.csv"
-    utf8_filename = f"settlement_{room_name}_{timestamp}.csv"
+    chunks = stream_csv([header, iter_export_rows(room_id), balances, payments])
+    return csv_response(chunks, "settlement", room_name)
+
+# ==================== 匯入相關 API ====================
+
+@app.route('/api/rooms/<room_id>/import', methods=['POST'])
+@login_required
+def import_room_expenses(room_id):
+    """
+    從 CSV 或 JSON Lines 匯入支出記錄（串流解析與回應）
+    
+    可用 multipart 上傳欄位 file，或直接以請求內容傳送檔案；
+    ?format=csv|jsonl 指定格式，未指定時依檔名或 Content-Type 判斷。
+    回應為 application/x-ndjson，逐行回報每行的錯誤與每個交易的進度
+    """
+    email = get_current_user()
     
-    # 建立回應
-    response = Response(
-        output.getvalue().encode('utf-8-sig'),
-        mimetype='text/csv; charset=utf-8-sig',
-        headers={
-            'Content-Disposition': f'attachment; filename="{safe_filename}"; filename*=UTF-8\'\'{quote(utf8_filename)}'
-        }
-    )
-    return response
+    if not can_access_room(email, room_id):
+        return jsonify({"error": "無權限存取此房間"}), 403
+    
+    upload = request.files.get('file')
+    if upload is not None:
+        file_format = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+    else:
+        file_format = request.args.get('format') or detect_format(content_type=request.mimetype)
+    
+    if file_format not in ("csv", "jsonl"):
+        return jsonify({"error": "不支援的匯入格式"}), 400
+    
+    if upload is not None:
+        # 視圖返回後 Flask 會關閉上傳的檔案，串流回應期間改讀自己的暫存檔
+        stream = tempfile.TemporaryFile()
+        shutil.copyfileobj(upload.stream, stream)
+        stream.seek(0)
+    else:
+        stream = request.stream
+    
+    # utf-8-sig 會去除 Excel 加上的 BOM；newline='' 讓 csv 模組處理欄位內的換行
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    def generate():
+        try:
+            for event in import_expenses(room_id, lines, file_format):
+                yield dumps(event) + "\n"
+        finally:
+            if upload is not None:
+                stream.close()
+            # 匯入可能分成多個交易，結束後讓頁面整個重新載入
+            version = get_room_version(room_id)
+            broker.publish(room_id, version, "reset", {"version": version})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 # ==================== 頁面路由 ====================
 
@@ -966,18 +928,16 @@ def get_all_users():
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT email, name, verified, created_at FROM users ORDER BY created_at DESC")
+    cursor.execute(ALL_USERS_QUERY)
     users = cursor.fetchall()
     
     # 取得所有管理員列表
-    cursor.execute("SELECT email FROM admins")
+    cursor.execute(ADMINS_QUERY)
     admin_emails = {row[0] for row in cursor.fetchall()}
     # 也包含環境變數中的管理員
     if ADMIN_EMAIL:
         admin_emails.add(ADMIN_EMAIL)
     
-    conn.close()
-    
     result = []
     for user in users:
         result.append({
@@ -1037,11 +997,9 @@ def create_user_by_admin():
     # 檢查使用者是否已存在
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT email FROM users WHERE email=?", (user_email,))
+    cursor.execute(USER_EXISTS_QUERY, (user_email,))
     if cursor.fetchone():
-        conn.close()
         return jsonify({"error": "使用者已存在"}), 400
-    conn.close()
     
     create_user(user_email, user_name)
     
@@ -1064,28 +1022,42 @@ def delete_user(user_email):
     cursor = conn.cursor()
     
     # 檢查使用者是否存在
-    cursor.execute("SELECT email FROM users WHERE email=?", (user_email,))
+    cursor.execute(USER_EXISTS_QUERY, (user_email,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "使用者不存在"}), 404
     
+    # 刪除參與者後需要重建餘額的房間
+    cursor.execute(PAYER_ROOMS_QUERY, (user_email,))
+    affected_rooms = [row[0] for row in cursor.fetchall()]
+    
+    # 成員或支出會變動的房間都要遞增版本號
+    cursor.execute(MEMBER_ROOMS_QUERY, (user_email,))
+    changed_rooms = set(affected_rooms) | {row[0] for row in cursor.fetchall()}
+    for changed_room_id in changed_rooms:
+        bump_room_version(cursor, changed_room_id)
+    
     # 刪除使用者相關資料
     # 刪除房間成員關係
-    cursor.execute("DELETE FROM room_members WHERE email=?", (user_email,))
+    cursor.execute(DELETE_USER_MEMBERSHIPS_QUERY, (user_email,))
     # 刪除支出參與者
-    cursor.execute("""
-        DELETE FROM expense_participants 
-        WHERE email=? AND expense_id IN (
-            SELECT id FROM expenses WHERE payer_email=?
-        )
-    """, (user_email, user_email))
+    cursor.execute(DELETE_PAYER_PARTICIPANTS_QUERY, (user_email, user_email))
     # 刪除使用者擁有的房間（可選，這裡選擇刪除）
-    cursor.execute("DELETE FROM rooms WHERE owner_email=?", (user_email,))
+    cursor.execute(DELETE_OWNED_ROOMS_QUERY, (user_email,))
     # 刪除使用者
-    cursor.execute("DELETE FROM users WHERE email=?", (user_email,))
+    cursor.execute(DELETE_USER_QUERY, (user_email,))
+    # 重建受影響房間的餘額彙總
+    for affected_room_id in affected_rooms:
+        rebuild_room_balances(cursor, affected_room_id)
     
     conn.commit()
-    conn.close()
+    invalidate_room_access()
+    invalidate_admins()
+    for changed_room_id in changed_rooms:
+        version = get_room_version(changed_room_id)
+        if version is None:
+            broker.publish(changed_room_id, None, "room_deleted", {})
+        else:
+            broker.publish(changed_room_id, version, "reset", {"version": version})
     
     return jsonify({"message": "使用者已刪除"})
 
@@ -1102,15 +1074,14 @@ def set_admin(user_email):
     cursor = conn.cursor()
     
     # 檢查使用者是否存在
-    cursor.execute("SELECT email FROM users WHERE email=?", (user_email,))
+    cursor.execute(USER_EXISTS_QUERY, (user_email,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "使用者不存在"}), 404
     
     # 添加為管理員
     cursor.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (user_email,))
     conn.commit()
-    conn.close()
+    invalidate_admins()
     
     return jsonify({"message": "已設置為管理員"})
 
@@ -1137,45 +1108,93 @@ def remove_admin(user_email):
     # 移除管理員權限
     cursor.execute("DELETE FROM admins WHERE email=?", (user_email,))
     conn.commit()
-    conn.close()
+    invalidate_admins()
     
     return jsonify({"message": "已移除管理員權限"})
 
+# 資料庫備份下載時每次讀取的區塊大小
+BACKUP_CHUNK_SIZE = 256 * 1024
+
 @app.route('/admin/export/database', methods=['GET'])
 @login_required
 def export_database():
-    """匯出 SQLite 資料庫（僅管理員）"""
+    """
+    匯出 SQLite 資料庫（僅管理員）
+    
+    以線上備份 API 建立一致的快照到暫存檔，再分塊串流回傳；
+    查詢參數 gzip=1 時即時以 gzip 壓縮
+    """
     email = get_current_user()
     
     if not is_admin(email):
         return jsonify({"error": "無權限"}), 403
     
-    from database import DB_NAME
-    from datetime import datetime
-    from urllib.parse import quote
-    
     if not os.path.exists(DB_NAME):
         return jsonify({"error": "資料庫檔案不存在"}), 404
     
-    # 讀取資料庫檔案
-    with open(DB_NAME, 'rb') as f:
-        db_data = f.read()
+    compress = request.args.get('gzip') == '1'
+    
+    # 建立備份快照
+    fd, backup_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        backup_database(backup_path)
+    except Exception:
+        os.remove(backup_path)
+        raise
+    
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 為 gzip 格式
+        with open(backup_path, 'rb') as f:
+            while True:
+                chunk = f.read(BACKUP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
     
     # 建立檔案名稱
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_filename = f"splitwise_backup_{timestamp}.db"
-    utf8_filename = f"分帳工具備份_{timestamp}.db"
+    extension = ".db.gz" if compress else ".db"
+    safe_filename = f"splitwise_backup_{timestamp}{extension}"
+    utf8_filename = f"分帳工具備份_{timestamp}{extension}"
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="{safe_filename}"; filename*=UTF-8\'\'{quote(utf8_filename)}'
+    }
+    if not compress:
+        headers['Content-Length'] = str(os.path.getsize(backup_path))
     
-    # 建立回應
     response = Response(
-        db_data,
-        mimetype='application/x-sqlite3',
-        headers={
-            'Content-Disposition': f'attachment; filename="{safe_filename}"; filename*=UTF-8\'\'{quote(utf8_filename)}'
-        }
+        generate(),
+        mimetype='application/gzip' if compress else 'application/x-sqlite3',
+        headers=headers
     )
+    # 暫存檔在回應結束時刪除：HEAD 請求或用戶端提早斷線時 generate() 不會執行到結尾
+    response.call_on_close(lambda: os.remove(backup_path))
     return response
 
+@app.route('/admin/stats', methods=['GET'])
+@login_required
+def get_stats():
+    """取得系統執行統計（僅管理員）"""
+    email = get_current_user()
+    
+    if not is_admin(email):
+        return jsonify({"error": "無權限"}), 403
+    
+    return jsonify({
+        "db_pool": get_pool().stats(),
+        "settlement_cache": settlement_cache.stats(),
+        "permission_cache": permission_cache.stats(),
+        "mail": mail_stats(),
+        "otp": otp_stats(),
+        "rate_limit": rate_limiter.stats(),
+        "events": broker.stats(),
+        "encoding": encoding_stats()
+    })
+
 @app.route('/admin')
 @login_required
 def admin_page():
@@ -1188,5 +1207,7 @@ def admin_page():
     return render_template('admin.html')
 
 if __name__ == '__main__':
+    # 開發用伺服器；正式環境請使用 gunicorn -c gunicorn.conf.py 或 python src/wsgi.py
+    init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
 
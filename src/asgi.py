@@ -0,0 +1,244 @@
+"""
+ASGI 應用程式：房間頁面的讀取 API 以非同步方式服務
+
+- GET /api/auth/me、/api/rooms/<id>、/api/rooms/<id>/expenses、/api/rooms/<id>/settlement、
+  /api/rooms/<id>/bootstrap
+  由事件迴圈處理連線，資料庫查詢交給有上限的執行緒池（ASGI_DB_THREADS），
+  一個 worker 可以同時保持大量連線，不必每個連線占用一條執行緒
+- GET /api/rooms/<id>/events 事件串流（見 events.py）在事件迴圈上等待，不占用執行緒，
+  也不受 EVENTS_MAX_STREAMS 限制
+- 其他路由以 a2wsgi 轉交原本的 Flask 應用程式，在另一個執行緒池（ASGI_WSGI_THREADS）執行，
+  回應以串流方式送出（匯出、匯入進度仍可逐段輸出）
+
+與 WSGI 模式共用 room_views.py、資料庫、Flask session cookie（需要相同的 SECRET_KEY）
+以及 encoding.py 的 JSON 序列化與壓縮設定。
+
+啟動（需先執行 python src/manage.py migrate）：
+    uvicorn asgi:app --app-dir src --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import concurrent.futures
+import os
+import re
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from werkzeug.wrappers import Request
+from app import app as flask_app
+from database import get_db
+from auth import can_access_room
+from encoding import encode_json, negotiate, compress, tag_etag, not_modified_etag, COMPRESS_MIN_SIZE
+from room_views import user_info, room_detail, expense_listing, room_settlement, room_bootstrap
+from events import broker, RoomStream, parse_version, EVENTS_POLL_SECONDS, EVENTS_STREAM_SECONDS
+
+# 資料庫查詢的執行緒數（每條執行緒使用自己的連線），不應超過 SQLite 能負荷的並行讀取數
+ASGI_DB_THREADS = int(os.getenv("ASGI_DB_THREADS", "4"))
+# 轉交 Flask 處理的路由可同時執行的請求數
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))
+
+_db_executor = concurrent.futures.ThreadPoolExecutor(ASGI_DB_THREADS, thread_name_prefix="asgi-db")
+# 整個 WSGI 回應（包含串流回應的迭代）都在同一條執行緒執行，stream_with_context 仍可使用
+_wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+# 非同步處理的路由：(路徑, 處理函式)，處理函式收到 (email, 路徑參數, 查詢參數, If-None-Match)，
+# 回傳 (狀態碼, 內容, 回應標頭)
+ROUTES = [
+    (re.compile(r"^/api/auth/me$"),
+     lambda email, params, query, etags: user_info(email) + ({},)),
+    (re.compile(r"^/api/rooms/(?P<room_id>[^/]+)$"),
+     lambda email, params, query, etags: room_detail(email, params["room_id"], etags)),
+    (re.compile(r"^/api/rooms/(?P<room_id>[^/]+)/expenses$"),
+     lambda email, params, query, etags: expense_listing(
+         email, params["room_id"], query.get("limit"), query.get("cursor"), etags
+     )),
+    (re.compile(r"^/api/rooms/(?P<room_id>[^/]+)/settlement$"),
+     lambda email, params, query, etags: room_settlement(email, params["room_id"], query.get("mode"), etags)),
+    (re.compile(r"^/api/rooms/(?P<room_id>[^/]+)/bootstrap$"),
+     lambda email, params, query, etags: room_bootstrap(email, params["room_id"], query.get("mode"), etags)),
+]
+
+EVENTS_ROUTE = re.compile(r"^/api/rooms/(?P<room_id>[^/]+)/events$")
+
+def _header(scope, name):
+    """取得請求標頭（多個同名標頭以逗號合併），不存在時回傳 None"""
+    values = [value.decode('latin-1') for key, value in scope["headers"] if key == name]
+    return ", ".join(values) if values else None
+
+def session_email(scope):
+    """以 Flask 的 session interface 讀取 session cookie，回傳登入的 email，未登入或簽章無效時回傳 None"""
+    cookies = [value.decode('latin-1') for key, value in scope["headers"] if key == b"cookie"]
+    if not cookies:
+        return None
+    
+    request = Request({"HTTP_COOKIE": "; ".join(cookies)})
+    session = flask_app.session_interface.open_session(flask_app, request)
+    return session.get("email") if session is not None else None
+
+def _run_db(func, *args):
+    """在資料庫執行緒中執行函式，結束時確保沒有留下未結束的交易"""
+    try:
+        return func(*args)
+    finally:
+        conn = get_db()
+        if conn.in_transaction:
+            conn.rollback()
+
+async def run_db(func, *args):
+    """在資料庫執行緒池執行函式並等待結果"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _run_db, func, *args)
+
+def parse_query(scope):
+    return {key: values[0] for key, values in parse_qs(scope["query_string"].decode('latin-1')).items()}
+
+async def send_json(send, status, body, headers=None, scope=None):
+    """
+    送出 JSON 回應（與 Flask 相同的序列化與壓縮設定），status 為 304 時不送內容
+    
+    有傳入 scope 時依 Accept-Encoding 壓縮
+    """
+    headers = dict(headers or {})
+    encoding = negotiate(_header(scope, b"accept-encoding")) if scope else None
+    vary = [(b"vary", b"Cookie"), (b"vary", b"Accept-Encoding")]
+    
+    if status == 304:
+        if "ETag" in headers:
+            headers["ETag"] = not_modified_etag(headers["ETag"], encoding, _header(scope, b"if-none-match"))
+        await send({"type": "http.response.start", "status": 304, "headers": _encode_headers(headers) + vary})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    
+    payload = encode_json(body)
+    if encoding is not None and len(payload) >= COMPRESS_MIN_SIZE:
+        payload = compress(payload, encoding)
+        headers["Content-Encoding"] = encoding
+        if "ETag" in headers:
+            headers["ETag"] = tag_etag(headers["ETag"], encoding)
+    
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode('ascii')),
+        ] + vary + _encode_headers(headers)
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+
+async def handle_view(scope, send, handler, params):
+    """非同步路由：檢查登入後在資料庫執行緒池執行處理函式"""
+    email = session_email(scope)
+    if email is None:
+        await send_json(send, 401, {"error": "請先登入"})
+        return
+    
+    status, body, headers = await run_db(
+        handler, email, params, parse_query(scope), _header(scope, b"if-none-match")
+    )
+    await send_json(send, status, body, headers, scope)
+
+async def wait_disconnect(receive):
+    """等到用戶端中斷連線（請求內容的訊息直接略過）"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def handle_events(scope, receive, send, room_id):
+    """房間事件串流：在事件迴圈上等待 broker 的事件，只有比對版本時才使用資料庫執行緒"""
+    email = session_email(scope)
+    if email is None:
+        await send_json(send, 401, {"error": "請先登入"})
+        return
+    
+    if not await run_db(can_access_room, email, room_id):
+        await send_json(send, 403, {"error": "無權限存取此房間"})
+        return
+    
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    subscription = broker.subscribe(room_id, notify=lambda: loop.call_soon_threadsafe(wake.set))
+    since = parse_version(_header(scope, b"last-event-id") or parse_query(scope).get("since"))
+    stream = RoomStream(email, room_id, since)
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ]
+        })
+        text = await run_db(stream.opening)
+        await send({"type": "http.response.body", "body": text.encode('utf-8'), "more_body": True})
+        
+        deadline = loop.time() + EVENTS_STREAM_SECONDS
+        while not stream.closed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            
+            wake.clear()
+            events = subscription.drain()
+            if events == []:
+                waiter = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait(
+                    {waiter, disconnect}, timeout=min(EVENTS_POLL_SECONDS, remaining),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                waiter.cancel()
+                if disconnect in done:
+                    return
+                if waiter in done:
+                    continue
+            
+            if events:
+                text = stream.render(events)
+            elif events is None:
+                # 佇列滿出：比對資料庫的版本
+                text = await run_db(stream.check)
+            else:
+                text = await run_db(stream.idle)
+            if text:
+                await send({"type": "http.response.body", "body": text.encode('utf-8'), "more_body": True})
+        
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnect.cancel()
+
+# ==================== ASGI 進入點 ====================
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _db_executor.shutdown(wait=False)
+            _wsgi.executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    
+    if scope["method"] == "GET":
+        match = EVENTS_ROUTE.match(scope["path"])
+        if match:
+            await handle_events(scope, receive, send, match.group("room_id"))
+            return
+        for pattern, handler in ROUTES:
+            match = pattern.match(scope["path"])
+            if match:
+                await handle_view(scope, send, handler, match.groupdict())
+                return
+    
+    await _wsgi(scope, receive, send)
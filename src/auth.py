@@ -1,7 +1,8 @@
 from functools import wraps
-from flask import session, jsonify, request, redirect, url_for
+from flask import session, jsonify, request, redirect, url_for, g, has_app_context
 import os
 from dotenv import load_dotenv
+from cache import create_cache
 
 # 從 ENV/.env 載入環境變數
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ENV', '.env')
@@ -10,6 +11,13 @@ load_dotenv(env_path)
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "")
 ADMIN_NAME = os.getenv("ADMIN_NAME", "管理員")
 
+# 權限快取：房間的擁有者與成員集合、管理員集合
+permission_cache = create_cache(
+    os.getenv("PERMISSION_CACHE_BACKEND", "memory"),
+    maxsize=int(os.getenv("PERMISSION_CACHE_SIZE", "4096")),
+    ttl=int(os.getenv("PERMISSION_CACHE_TTL", "10"))
+)
+
 def login_required(f):
     """裝飾器：要求使用者必須登入"""
     @wraps(f)
@@ -31,82 +39,107 @@ def is_admin(email):
         return True
     
     # 檢查資料庫中的管理員列表
-    from database import get_db
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT email FROM admins WHERE email=?", (email,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    return result is not None
+    return email in get_admin_set()
 
 def get_current_user():
     """取得當前登入的使用者 email"""
     return session.get('email')
 
+# ==================== 權限快取 ====================
+# 兩層快取：同一個請求內存在 g，跨請求存在短 TTL 的行程內快取。
+# 成員或管理員異動的路由會呼叫 invalidate_*；多個 worker 之間則依 TTL 自然過期。
+
+_ADMINS_KEY = ("admins",)
+
+def _request_cache():
+    """取得請求範圍的快取（請求之外回傳 None）"""
+    if not has_app_context():
+        return None
+    if 'auth_cache' not in g:
+        g.auth_cache = {}
+    return g.auth_cache
+
+def _cached(key, load):
+    """依序查詢請求快取、行程快取，都沒有時呼叫 load() 並寫回"""
+    local = _request_cache()
+    if local is not None and key in local:
+        return local[key]
+    
+    value = permission_cache.get(key)
+    if value is None:
+        value = load()
+        permission_cache.set(key, value)
+    
+    if local is not None:
+        local[key] = value
+    return value
+
+ADMINS_QUERY = "SELECT email FROM admins"
+ROOM_ACCESS_QUERY = """
+    SELECT r.owner_email, rm.email
+    FROM rooms r
+    LEFT JOIN room_members rm ON rm.room_id = r.id
+    WHERE r.id = ?
+"""
+
+def get_admin_set():
+    """取得資料庫中的管理員集合"""
+    def load():
+        from database import get_db
+        cursor = get_db().cursor()
+        cursor.execute(ADMINS_QUERY)
+        return frozenset(row[0] for row in cursor.fetchall())
+    
+    return _cached(_ADMINS_KEY, load)
+
+def get_room_access(room_id):
+    """
+    取得房間的 (擁有者, 成員集合)，房間不存在時擁有者為 None
+    
+    以單一查詢同時取得擁有者與所有成員
+    """
+    def load():
+        from database import get_db
+        cursor = get_db().cursor()
+        cursor.execute(ROOM_ACCESS_QUERY, (room_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            return (None, frozenset())
+        return (rows[0][0], frozenset(row[1] for row in rows if row[1] is not None))
+    
+    return _cached(("room", room_id), load)
+
+def invalidate_room_access(room_id=None):
+    """房間成員異動後清除快取（room_id 為 None 時清除所有房間）"""
+    if room_id is None:
+        permission_cache.delete_where(lambda key: key[0] == "room")
+    else:
+        permission_cache.delete(("room", room_id))
+    
+    local = _request_cache()
+    if local is not None:
+        for key in [key for key in local if key[0] == "room" and (room_id is None or key[1] == room_id)]:
+            del local[key]
+
+def invalidate_admins():
+    """管理員名單異動後清除快取"""
+    permission_cache.delete(_ADMINS_KEY)
+    local = _request_cache()
+    if local is not None:
+        local.pop(_ADMINS_KEY, None)
+
 def can_access_room(email, room_id):
-    """檢查使用者是否有權限存取房間"""
-    from database import get_db
-    
+    """檢查使用者是否有權限存取房間（管理員、擁有者或成員）"""
     # 管理員可以存取所有房間
     if is_admin(email):
         return True
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # 檢查是否為房間擁有者
-    cursor.execute("SELECT owner_email FROM rooms WHERE id=?", (room_id,))
-    room = cursor.fetchone()
-    
-    if not room:
-        conn.close()
+    owner_email, members = get_room_access(room_id)
+    if owner_email is None:
         return False
     
-    if room[0] == email:
-        conn.close()
-        return True
-    
-    # 檢查是否為房間成員
-    cursor.execute(
-        "SELECT id FROM room_members WHERE room_id=? AND email=?",
-        (room_id, email)
-    )
-    member = cursor.fetchone()
-    conn.close()
-    
-    return member is not None
+    return email == owner_email or email in members
 
 def can_invite_to_room(email, room_id):
-    """檢查使用者是否可以邀請他人加入房間"""
-    from database import get_db
-    
-    # 管理員可以邀請
-    if is_admin(email):
-        return True
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # 檢查是否為房間擁有者
-    cursor.execute("SELECT owner_email FROM rooms WHERE id=?", (room_id,))
-    room = cursor.fetchone()
-    
-    if not room:
-        conn.close()
-        return False
-    
-    if room[0] == email:
-        conn.close()
-        return True
-    
-    # 檢查是否為房間成員（成員也可以邀請）
-    cursor.execute(
-        "SELECT id FROM room_members WHERE room_id=? AND email=?",
-        (room_id, email)
-    )
-    member = cursor.fetchone()
-    conn.close()
-    
-    return member is not None
-
+    """檢查使用者是否可以邀請他人加入房間（成員也可以邀請，規則與存取相同）"""
+    return can_access_room(email, room_id)
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """行程內 LRU 快取：限制項目數量並支援 TTL 到期"""
+    
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (到期時間, 值)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+    
+    def get(self, key, default=None):
+        """取得快取值，不存在或已過期時回傳 default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._misses += 1
+                return default
+            
+            expires_at, value = item
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+    
+    def set(self, key, value):
+        """寫入快取，超過容量時淘汰最久未使用的項目"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+    
+    def delete(self, key):
+        """刪除單一項目"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def delete_where(self, predicate):
+        """刪除 key 符合條件的所有項目"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+    
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        """取得命中、未命中與淘汰次數"""
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations
+            }
+
+class NullCache:
+    """不快取任何內容（停用快取時使用）"""
+    
+    def __init__(self, **kwargs):
+        self._misses = 0
+    
+    def get(self, key, default=None):
+        self._misses += 1
+        return default
+    
+    def set(self, key, value):
+        pass
+    
+    def delete(self, key):
+        pass
+    
+    def delete_where(self, predicate):
+        pass
+    
+    def clear(self):
+        pass
+    
+    def stats(self):
+        return {"backend": "none", "misses": self._misses}
+
+# 可用的快取後端，其他後端（例如 Redis）實作相同介面後註冊到這裡即可
+BACKENDS = {
+    "memory": LRUCache,
+    "none": NullCache,
+}
+
+def create_cache(backend="memory", **kwargs):
+    """依名稱建立快取後端"""
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的快取後端：{backend}")
+    return BACKENDS[backend](**kwargs)
@@ -1,102 +1,296 @@
+import copy
+import os
 from database import get_db
-from collections import defaultdict
+from models import get_room_version
 
-def calculate_settlement(room_id):
+# NumPy 為可選依賴：安裝時大型房間的彙總改用向量化計算
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from cache import create_cache
+from optimizer import greedy_payments, min_transfer_payments
+
+# 可選的結算模式
+SETTLEMENT_MODES = ("greedy", "min_transfers")
+
+# 彙總計算方式：auto（安裝 NumPy 時使用）、numpy 或 sql
+TOTALS_BACKEND = os.getenv("TOTALS_BACKEND", "auto")
+
+# 結算結果快取：以 (room_id, 房間版本) 為 key，寫入時房間版本遞增即自動失效
+settlement_cache = create_cache(
+    os.getenv("SETTLEMENT_CACHE_BACKEND", "memory"),
+    maxsize=int(os.getenv("SETTLEMENT_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("SETTLEMENT_CACHE_TTL", "300"))
+)
+
+# 以單一聚合查詢計算每人的 paid 與 share：
+# 先在 CTE 中算出每筆支出的參與人數，再把「付款」與「分攤」兩種紀錄
+# UNION ALL 起來依 email 加總，避免逐筆支出查詢參與者（N+1）。
+# 沒有參與者的支出不會出現在 JOIN 結果中，與原本略過的行為一致。
+# refs 為此人被計入的次數，用來判斷 room_balances 的列何時可以刪除。
+TOTALS_QUERY = """
+    WITH shares AS (
+        SELECT e.id, e.amount, e.payer_email, COUNT(ep.email) AS participant_count
+        FROM expenses e
+        JOIN expense_participants ep ON ep.expense_id = e.id
+        WHERE e.room_id = ?
+        GROUP BY e.id
+    )
+    SELECT email, SUM(paid), SUM(share), COUNT(*)
+    FROM (
+        SELECT payer_email AS email, amount AS paid, 0 AS share
+        FROM shares
+        UNION ALL
+        SELECT ep.email, 0, CAST(s.amount / s.participant_count AS INTEGER)
+        FROM shares s
+        JOIN expense_participants ep ON ep.expense_id = s.id
+    )
+    GROUP BY email
+"""
+
+def compute_totals(cursor, room_id):
+    """從支出記錄重新計算房間內每人的總付款與總負擔，回傳 {email: (paid, share, refs)}"""
+    if np is not None and TOTALS_BACKEND in ("auto", "numpy"):
+        totals = compute_totals_numpy(cursor, room_id)
+        if totals is not None:
+            return totals
+    
+    return compute_totals_sql(cursor, room_id)
+
+def compute_totals_sql(cursor, room_id):
+    """以單一聚合查詢計算彙總（未安裝 NumPy 時使用）"""
+    cursor.execute(TOTALS_QUERY, (room_id,))
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+def compute_totals_numpy(cursor, room_id):
     """
-    計算房間的結算結果
+    以 NumPy 陣列計算彙總，結果與 compute_totals_sql 相同
     
-    回傳格式：
-    {
-        "balances": [{"email": "A", "balance": -600}, ...],
-        "payments": [{"from": "A", "to": "B", "amount": 600}, ...]
-    }
+    支出載入為 (expense_id, amount, payer_idx)，參與者載入為 (expense_id, participant_idx)，
+    再用 bincount / np.add.at 依成員加總。金額不是整數時回傳 None，交由 SQL 計算。
     """
-    conn = get_db()
-    cursor = conn.cursor()
+    # 大量資料列時 sqlite3.Row 的建立成本明顯，這裡改用一般 tuple
+    cursor = cursor.connection.cursor()
+    cursor.row_factory = None
     
-    # 取得所有支出
     cursor.execute(
-        "SELECT id, title, amount, payer_email FROM expenses WHERE room_id=?",
+        "SELECT id, amount, payer_email FROM expenses WHERE room_id=? ORDER BY id",
         (room_id,)
     )
     expenses = cursor.fetchall()
+    if not expenses:
+        return {}
     
-    # 計算每人的 total_paid 和 total_share
-    total_paid = defaultdict(int)  # 每人總共付了多少
-    total_share = defaultdict(int)  # 每人應該負擔多少
+    cursor.execute("""
+        SELECT ep.expense_id, ep.email
+        FROM expense_participants ep
+        JOIN expenses e ON e.id = ep.expense_id
+        WHERE e.room_id = ?
+    """, (room_id,))
+    participants = cursor.fetchall()
     
-    for expense in expenses:
-        expense_id = expense[0]
-        amount = expense[2]
-        payer_email = expense[3]
-        
-        # 取得參與者
-        cursor.execute(
-            "SELECT email FROM expense_participants WHERE expense_id=?",
-            (expense_id,)
-        )
-        participants = cursor.fetchall()
-        
+    # email -> 成員索引
+    members = {}
+    expense_ids = np.array([row[0] for row in expenses], dtype=np.int64)
+    amounts = np.array([row[1] for row in expenses])
+    if amounts.dtype.kind != 'i':
+        return None
+    amounts = amounts.astype(np.int64)
+    payer_idx = np.array([members.setdefault(row[2], len(members)) for row in expenses], dtype=np.int64)
+    
+    part_expense = np.searchsorted(expense_ids, np.array([row[0] for row in participants], dtype=np.int64))
+    part_idx = np.array([members.setdefault(row[1], len(members)) for row in participants], dtype=np.int64)
+    
+    # 沒有參與者的支出不計入，與 SQL 的 JOIN 行為一致
+    counts = np.bincount(part_expense, minlength=len(expense_ids))
+    valid = counts > 0
+    share_each = amounts // np.maximum(counts, 1)
+    
+    paid = np.zeros(len(members), dtype=np.int64)
+    share = np.zeros(len(members), dtype=np.int64)
+    np.add.at(paid, payer_idx[valid], amounts[valid])
+    np.add.at(share, part_idx, share_each[part_expense])
+    refs = (np.bincount(payer_idx[valid], minlength=len(members))
+            + np.bincount(part_idx, minlength=len(members)))
+    
+    return {
+        email: (int(paid[index]), int(share[index]), int(refs[index]))
+        for email, index in members.items()
+        if refs[index] > 0
+    }
+
+# ==================== 餘額彙總表 room_balances ====================
+# 支出寫入時在同一個交易內增量更新，結算只需讀取 O(成員數) 列
+
+def apply_expense(cursor, room_id, amount, payer_email, participants, sign=1):
+    """將一筆支出的付款與分攤加入 room_balances（sign=-1 表示扣除）"""
+    apply_expenses(cursor, room_id, [(amount, payer_email, participants)], sign)
+
+def apply_expenses(cursor, room_id, expenses, sign=1):
+    """
+    將多筆支出合併成每人一列的差額後寫入 room_balances
+    
+    expenses 為 [(amount, payer_email, participants), ...]，sign=-1 表示扣除
+    """
+    # email -> [paid, share, refs]
+    deltas = {}
+    for amount, payer_email, participants in expenses:
         if not participants:
             continue
         
-        participant_count = len(participants)
-        share_per_person = amount // participant_count
+        share_per_person = amount // len(participants)
         
-        # 記錄付款者
-        total_paid[payer_email] += amount
+        delta = deltas.setdefault(payer_email, [0, 0, 0])
+        delta[0] += amount
+        delta[2] += 1
+        for participant_email in participants:
+            delta = deltas.setdefault(participant_email, [0, 0, 0])
+            delta[1] += share_per_person
+            delta[2] += 1
+    
+    if not deltas:
+        return
+    
+    cursor.executemany("""
+        INSERT INTO room_balances (room_id, email, paid, share, refs)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (room_id, email) DO UPDATE SET
+            paid = paid + excluded.paid,
+            share = share + excluded.share,
+            refs = refs + excluded.refs
+    """, [
+        (room_id, email, sign * paid, sign * share, sign * refs)
+        for email, (paid, share, refs) in deltas.items()
+    ])
+    
+    if sign < 0:
+        cursor.execute("DELETE FROM room_balances WHERE room_id=? AND refs <= 0", (room_id,))
+
+STORED_PARTICIPANTS_QUERY = "SELECT email FROM expense_participants WHERE expense_id=?"
+
+def apply_stored_expense(cursor, expense_id, sign=-1):
+    """依資料庫中現有的支出內容更新 room_balances（預設為扣除，用於修改或刪除前）"""
+    cursor.execute("SELECT room_id, amount, payer_email FROM expenses WHERE id=?", (expense_id,))
+    expense = cursor.fetchone()
+    if not expense:
+        return
+    
+    cursor.execute(STORED_PARTICIPANTS_QUERY, (expense_id,))
+    participants = [row[0] for row in cursor.fetchall()]
+    
+    apply_expense(cursor, expense[0], expense[1], expense[2], participants, sign)
+
+def rebuild_room_balances(cursor, room_id):
+    """從支出記錄重建單一房間的 room_balances"""
+    totals = compute_totals(cursor, room_id)
+    cursor.execute("DELETE FROM room_balances WHERE room_id=?", (room_id,))
+    cursor.executemany(
+        "INSERT INTO room_balances (room_id, email, paid, share, refs) VALUES (?, ?, ?, ?, ?)",
+        [(room_id, email, paid, share, refs) for email, (paid, share, refs) in totals.items()]
+    )
+
+def _balance_room_ids(cursor):
+    """取得有支出或有餘額記錄的所有房間"""
+    cursor.execute("SELECT DISTINCT room_id FROM expenses UNION SELECT DISTINCT room_id FROM room_balances")
+    return [row[0] for row in cursor.fetchall()]
+
+def rebuild_all_balances(cursor):
+    """重建所有房間的 room_balances"""
+    for room_id in _balance_room_ids(cursor):
+        rebuild_room_balances(cursor, room_id)
+
+def check_balances(cursor, room_ids=None):
+    """
+    比對 room_balances 與從支出記錄重新計算的結果
+    
+    回傳差異列表 [{"room_id", "email", "expected", "actual"}, ...]，
+    expected / actual 為 (paid, share, refs)，不存在時為 None
+    """
+    if room_ids is None:
+        room_ids = _balance_room_ids(cursor)
+    
+    diffs = []
+    for room_id in room_ids:
+        expected = compute_totals(cursor, room_id)
+        cursor.execute(
+            "SELECT email, paid, share, refs FROM room_balances WHERE room_id=?",
+            (room_id,)
+        )
+        actual = {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
         
-        # 記錄每個參與者的負擔
-        for participant in participants:
-            total_share[participant[0]] += share_per_person
+        for email in sorted(set(expected) | set(actual)):
+            if expected.get(email) != actual.get(email):
+                diffs.append({
+                    "room_id": room_id,
+                    "email": email,
+                    "expected": expected.get(email),
+                    "actual": actual.get(email)
+                })
+    
+    return diffs
+
+BALANCES_QUERY = "SELECT email, paid, share FROM room_balances WHERE room_id=?"
+
+def calculate_settlement(room_id, mode="greedy"):
+    """
+    計算房間的結算結果
+    
+    mode 為 SETTLEMENT_MODES 之一：greedy（雙指針配對）或 min_transfers（最少轉帳筆數）
+    
+    回傳格式：
+    {
+        "balances": [{"email": "A", "balance": -600}, ...],
+        "payments": [{"from": "A", "to": "B", "amount": 600}, ...],
+        "mode": "greedy",
+        "algorithm": "greedy"  # min_transfers 時為 exact 或 heuristic
+    }
+    """
+    conn = get_db()
+    cursor = conn.cursor()
     
-    conn.close()
+    # 從彙總表讀取每人的 total_paid 和 total_share
+    cursor.execute(BALANCES_QUERY, (room_id,))
     
     # 計算 balance = total_paid - total_share
     balances = {}
-    for email in set(list(total_paid.keys()) + list(total_share.keys())):
-        balances[email] = total_paid[email] - total_share[email]
+    for email, total_paid, total_share in cursor.fetchall():
+        balances[email] = total_paid - total_share
     
     # 轉換為列表格式
     balance_list = [{"email": email, "balance": balance} 
                     for email, balance in balances.items()]
     
-    # 分離債權人和債務人
-    creditors = [(email, balance) for email, balance in balances.items() if balance > 0]
-    debtors = [(email, -balance) for email, balance in balances.items() if balance < 0]
-    
-    # 排序：債權人從大到小，債務人從大到小
-    creditors.sort(key=lambda x: x[1], reverse=True)
-    debtors.sort(key=lambda x: x[1], reverse=True)
-    
-    # 雙指針配對算法
-    payments = []
-    i = 0  # 債權人索引
-    j = 0  # 債務人索引
-    
-    while i < len(creditors) and j < len(debtors):
-        creditor_email, creditor_amount = creditors[i]
-        debtor_email, debtor_amount = debtors[j]
-        
-        payment_amount = min(creditor_amount, debtor_amount)
-        
-        if payment_amount > 0:
-            payments.append({
-                "from": debtor_email,
-                "to": creditor_email,
-                "amount": payment_amount
-            })
-        
-        creditors[i] = (creditor_email, creditor_amount - payment_amount)
-        debtors[j] = (debtor_email, debtor_amount - payment_amount)
-        
-        if creditors[i][1] == 0:
-            i += 1
-        if debtors[j][1] == 0:
-            j += 1
+    if mode == "greedy":
+        payments = greedy_payments(balances.items())
+        algorithm = "greedy"
+    else:
+        payments, algorithm = min_transfer_payments(balances.items())
     
     return {
         "balances": balance_list,
-        "payments": payments
+        "payments": payments,
+        "mode": mode,
+        "algorithm": algorithm
     }
 
+def get_room_settlement(room_id, mode="greedy"):
+    """
+    取得房間的結算結果（優先使用快取）
+    
+    回傳的是副本，呼叫端可以直接加入名稱等欄位
+    """
+    version = get_room_version(room_id)
+    key = (room_id, version, mode)
+    result = settlement_cache.get(key)
+    if result is None:
+        result = calculate_settlement(room_id, mode)
+        # 舊版本的結果不會再被讀到，順便清掉
+        settlement_cache.delete_where(lambda old_key: old_key[0] == room_id and old_key[1] != version)
+        settlement_cache.set(key, result)
+    
+    return copy.deepcopy(result)
+
+def invalidate_settlement(room_id):
+    """移除房間所有版本的結算快取（房間刪除時使用）"""
+    settlement_cache.delete_where(lambda key: key[0] == room_id)
@@ -1,20 +1,173 @@
 import sqlite3
 import os
+import queue
+import threading
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from flask import g, has_app_context
+
+# 從 ENV/.env 載入環境變數
+env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ENV', '.env')
+load_dotenv(env_path)
 
 DB_NAME = "splitwise.db"
 
-def get_db():
-    """取得資料庫連線"""
-    conn = sqlite3.connect(DB_NAME)
+# 連線池設定
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# SQLite 效能設定
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-20000"))  # 負數代表 KiB，約 20MB
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# 每條連線建立時套用一次的 PRAGMA
+# journal_mode=WAL 會寫入資料庫檔案，由遷移設定一次即可
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = %d" % DB_CACHE_SIZE,
+    "PRAGMA mmap_size = %d" % DB_MMAP_SIZE,
+    "PRAGMA temp_store = MEMORY",
+)
+
+def connect():
+    """建立一條新的資料庫連線並套用 PRAGMA"""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
-    """初始化資料庫，建立所有必要的表格"""
-    conn = get_db()
-    cursor = conn.cursor()
+class PoolExhaustedError(Exception):
+    """連線池在等待時間內沒有可用連線"""
+
+class ConnectionPool:
+    """SQLite 連線池：最多建立 size 條連線，用完後歸還重複使用"""
+    
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
     
+    def acquire(self):
+        """借出一條連線，池已滿時最多等待 timeout 秒"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        
+        if conn is None:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            
+            if can_create:
+                try:
+                    conn = connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                with self._lock:
+                    self._waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolExhaustedError("資料庫連線池已滿，請稍後再試")
+        
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+    
+    def release(self, conn):
+        """歸還連線（未提交的交易會被回滾）"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+    
+    def stats(self):
+        """取得連線池統計資料"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._created - self._in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def get_pool():
+    """取得（必要時建立）全域連線池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def get_db():
+    """
+    取得資料庫連線
+    
+    在 Flask 請求中，同一個請求共用一條從連線池借出的連線，
+    請求結束時由 close_db 歸還；請求之外（啟動、背景執行緒）
+    則使用該執行緒專屬的連線。呼叫端不需要自行關閉連線。
+    """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = get_pool().acquire()
+        return g.db
+    
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+    return conn
+
+def begin_immediate(conn):
+    """開始一個立即取得寫入鎖的交易（已在交易中時不做任何事）"""
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+def backup_database(dest_path):
+    """使用 SQLite 線上備份 API 將資料庫複製到 dest_path（一致的快照，不阻擋寫入）"""
+    source = connect()
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+
+def close_db(exception=None):
+    """將請求使用的連線歸還連線池"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+def init_app(app):
+    """在 Flask app 註冊連線的回收處理"""
+    app.teardown_appcontext(close_db)
+
+# ==================== 資料庫遷移 ====================
+
+def _migration_initial_schema(cursor):
+    """建立初始資料表"""
     # users 表格
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -26,11 +179,11 @@ def init_db():
         )
     """)
     
-    # 如果 name 欄位不存在，添加它（用於現有資料庫）
-    try:
+    # 如果 name 欄位不存在，添加它（用於舊版資料庫）
+    cursor.execute("PRAGMA table_info(users)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'name' not in columns:
         cursor.execute("ALTER TABLE users ADD COLUMN name TEXT")
-    except sqlite3.OperationalError:
-        pass  # 欄位已存在
     
     # login_tokens 表格
     cursor.execute("""
@@ -91,6 +244,206 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+
+def _migration_enable_wal(cursor):
+    """改用 WAL 日誌模式，讓寫入時不會阻擋讀取"""
+    cursor.execute("PRAGMA journal_mode = WAL")
+
+# 遷移內容在發布後即固定：不引用會隨程式修改的常數或函式，之後的變更一律附加新的遷移
+# UNIQUE / PRIMARY KEY 已自動建立的索引不重複建立：
+#   expense_participants(expense_id, email)、room_members(room_id, email)、login_tokens(email)
+
+def _migration_hot_indexes(cursor):
+    """建立熱門查詢路徑的索引"""
+    # 支出列表依建立時間排序（get_expenses、匯出）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_expenses_room_created ON expenses (room_id, created_at DESC)")
+    # 結算與統計只需要付款人與金額，覆蓋索引免回表
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_expenses_room_payer_amount ON expenses (room_id, payer_email, amount)")
+    # 房間列表依成員 email 查詢參與的房間
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_room_members_email ON room_members (email, room_id)")
+    # 房間列表依擁有者查詢
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rooms_owner ON rooms (owner_email)")
+    cursor.execute("ANALYZE")
+
+def _migration_expense_keyset_index(cursor):
+    """支出索引加入 id，讓 (created_at, id) 分頁游標可以直接走索引"""
+    cursor.execute("DROP INDEX IF EXISTS idx_expenses_room_created")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_expenses_room_created_id ON expenses (room_id, created_at DESC, id DESC)"
+    )
+    cursor.execute("ANALYZE")
+
+def _migration_room_balances(cursor):
+    """建立每個房間每人付款與分攤的彙總表，並從現有支出計算初始值"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS room_balances (
+            room_id TEXT NOT NULL,
+            email TEXT NOT NULL,
+            paid INTEGER NOT NULL DEFAULT 0,
+            share INTEGER NOT NULL DEFAULT 0,
+            refs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (room_id, email)
+        ) WITHOUT ROWID
+    """)
+    # 與當時的 calculations.TOTALS_QUERY 相同的計算，一次涵蓋所有房間
+    cursor.execute("DELETE FROM room_balances")
+    cursor.execute("""
+        INSERT INTO room_balances (room_id, email, paid, share, refs)
+        WITH shares AS (
+            SELECT e.id, e.room_id, e.amount, e.payer_email, COUNT(ep.email) AS participant_count
+            FROM expenses e
+            JOIN expense_participants ep ON ep.expense_id = e.id
+            GROUP BY e.id
+        )
+        SELECT room_id, email, SUM(paid), SUM(share), COUNT(*)
+        FROM (
+            SELECT room_id, payer_email AS email, amount AS paid, 0 AS share
+            FROM shares
+            UNION ALL
+            SELECT s.room_id, ep.email, 0, CAST(s.amount / s.participant_count AS INTEGER)
+            FROM shares s
+            JOIN expense_participants ep ON ep.expense_id = s.id
+        )
+        GROUP BY room_id, email
+    """)
+
+def _migration_room_version(cursor):
+    """房間加入版本號，房間內的支出或成員變動時遞增，用於快取失效"""
+    cursor.execute("ALTER TABLE rooms ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+def _migration_mail_outbox(cursor):
+    """建立郵件寄送佇列，由背景執行緒寄出"""
+    # next_attempt_at 為 epoch 秒數；被取出寄送時會先延後一段租約時間，
+    # 寄送中的行程若中途結束，租約到期後會由其他執行緒重新取出
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mail_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox (status, next_attempt_at)"
+    )
+
+def _migration_login_tokens_epoch(cursor):
+    """login_tokens 改為每個 email 一組 OTP，過期時間改存 epoch 秒數並加上索引供定期清除"""
+    # 舊的 OTP 最多 10 分鐘有效，直接捨棄，使用者重新發送即可
+    cursor.execute("DROP TABLE IF EXISTS login_tokens")
+    cursor.execute("""
+        CREATE TABLE login_tokens (
+            email TEXT PRIMARY KEY,
+            otp TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_login_tokens_expires ON login_tokens (expires_at)")
+
+def _migration_rate_limits(cursor):
+    """建立限流計數表，多個 worker 行程共用（RATE_LIMIT_BACKEND=sqlite 時使用）"""
+    # window_start 與 expires_at 為 epoch 秒數；過了 expires_at 計數已不影響限流，可刪除
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            window_start INTEGER NOT NULL,
+            previous_count INTEGER NOT NULL DEFAULT 0,
+            current_count INTEGER NOT NULL DEFAULT 0,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_expires ON rate_limits (expires_at)")
+
+def _migration_room_updated_at(cursor):
+    """房間加入最後修改時間（epoch 秒數），與版本號一起遞增，用於 Last-Modified"""
+    # ALTER TABLE 不能使用非常數的預設值，既有房間以建立時間填入
+    cursor.execute("ALTER TABLE rooms ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE rooms SET updated_at = CAST(strftime('%s', created_at) AS INTEGER)")
+
+def _migration_redact_failed_mail(cursor):
+    """清除已放棄寄送的郵件內容（內含明文驗證碼），之後放棄寄送時會直接清除"""
+    cursor.execute("UPDATE mail_outbox SET body = '' WHERE status = 'failed'")
+
+def _migration_expense_payer_index(cursor):
+    """刪除使用者時依付款人查詢支出，避免掃描整個支出索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_expenses_payer ON expenses (payer_email, room_id)")
+    cursor.execute("ANALYZE")
+
+# 依版本順序執行的遷移，新增遷移時只能附加在最後面
+MIGRATIONS = [
+    (1, "建立初始資料表", _migration_initial_schema),
+    (2, "啟用 WAL 日誌模式", _migration_enable_wal),
+    (3, "建立熱門查詢索引", _migration_hot_indexes),
+    (4, "支出分頁索引", _migration_expense_keyset_index),
+    (5, "建立餘額彙總表", _migration_room_balances),
+    (6, "房間版本號", _migration_room_version),
+    (7, "郵件寄送佇列", _migration_mail_outbox),
+    (8, "OTP 過期時間索引", _migration_login_tokens_epoch),
+    (9, "限流計數表", _migration_rate_limits),
+    (10, "房間最後修改時間", _migration_room_updated_at),
+    (11, "清除寄送失敗郵件的內容", _migration_redact_failed_mail),
+    (12, "支出付款人索引", _migration_expense_payer_index),
+]
+
+# 不能在交易中執行的遷移（journal_mode 無法在交易內切換）；內容可重複執行
+NON_TRANSACTIONAL_MIGRATIONS = (_migration_enable_wal,)
+
+def get_schema_version(cursor):
+    """取得目前資料庫的 schema 版本"""
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    result = cursor.fetchone()
+    return result[0] or 0
+
+def migrate(conn):
+    """執行所有尚未套用的遷移，回傳已套用的版本列表"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    current = get_schema_version(cursor)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        # 每個遷移與它的 schema_version 紀錄在同一個交易內（SQLite 的 DDL 也可以回滾），
+        # 中途失敗時不會留下套用一半的遷移；取得寫入鎖後重新確認，避免多個行程重複套用
+        if migration not in NON_TRANSACTIONAL_MIGRATIONS:
+            cursor.execute("BEGIN IMMEDIATE")
+            if get_schema_version(cursor) >= version:
+                conn.rollback()
+                continue
+        try:
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append(version)
+    
+    return applied
+
+def init_db():
+    """初始化資料庫，執行遷移並建立初始管理員"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    migrate(conn)
     
     # 如果 ADMIN_EMAIL 存在，將其加入管理員表
     admin_email = os.getenv("ADMIN_EMAIL", "")
@@ -98,5 +451,3 @@ def init_db():
         cursor.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (admin_email,))
     
     conn.commit()
-    conn.close()
-
@@ -0,0 +1,208 @@
+"""
+回應編碼：JSON 序列化與 HTTP 壓縮
+
+- JSON：JSON_BACKEND=auto（預設，依序使用已安裝的 orjson、ujson，都沒有時使用標準函式庫）、
+  orjson、ujson 或 json。Flask 的 jsonify、ASGI 的回應與 SSE 事件共用同一個序列化函式，
+  輸出為精簡格式、非 ASCII 字元不跳脫
+- 壓縮：/api/* 與匯出路由依 Accept-Encoding 協商 br（需安裝 brotli）或 gzip；
+  小於 COMPRESS_MIN_SIZE 的回應不壓縮；串流回應（CSV 匯出、匯入進度）逐段壓縮並立即送出；
+  SSE 與已壓縮的內容不壓縮
+- 壓縮後的回應在 ETag 加上 -gzip / -br，同一個網址不同編碼的內容不共用同一個強 ETag
+"""
+import json
+import os
+import zlib
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag, unquote_etag
+
+# orjson、ujson、brotli 皆為可選依賴
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON 序列化方式：auto、orjson、ujson 或 json
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+# 回應內容至少這麼大才壓縮（位元組），太小的回應壓縮後反而變大
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+# gzip 壓縮等級（1-9）與 brotli 品質（0-11），預設偏向速度
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# 套用壓縮的路徑
+COMPRESS_PATHS = ("/api/", "/admin/export/")
+# SSE 需要每個事件立即送出；已壓縮的格式再壓縮沒有效果
+SKIP_MIMETYPES = ("text/event-stream", "application/gzip", "application/zip")
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gzip"}
+
+# 伺服器支援的壓縮方式，依偏好排序
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def _select_backend():
+    if JSON_BACKEND in ("auto", "orjson") and orjson is not None:
+        return "orjson"
+    if JSON_BACKEND in ("auto", "ujson") and ujson is not None:
+        return "ujson"
+    return "json"
+
+json_backend = _select_backend()
+
+if json_backend == "orjson":
+    # 非字串的 key 轉成字串；datetime 交給 Flask 的預設處理（HTTP 日期格式），與 jsonify 一致
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def encode_json(obj):
+    """序列化為 UTF-8 編碼的精簡 JSON"""
+    if json_backend == "orjson":
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+    return dumps(obj).encode('utf-8')
+
+def dumps(obj):
+    """序列化為精簡的 JSON 字串（非 ASCII 字元不跳脫）"""
+    if json_backend == "orjson":
+        return encode_json(obj).decode('utf-8')
+    if json_backend == "ujson":
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=DefaultJSONProvider.default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=DefaultJSONProvider.default)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """使用 JSON_BACKEND 序列化的 Flask JSON provider；debug 模式的縮排輸出仍使用預設實作"""
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs.get("indent") is not None:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+    
+    def loads(self, s, **kwargs):
+        if json_backend == "orjson" and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+    
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(encode_json(obj), mimetype=self.mimetype)
+
+# ==================== 壓縮 ====================
+
+def negotiate(accept_encoding):
+    """依 Accept-Encoding 選擇壓縮方式，品質相同時依 ENCODINGS 的順序，不接受壓縮時回傳 None"""
+    if not accept_encoding:
+        return None
+    
+    accepted = parse_accept_header(accept_encoding)
+    best = None
+    best_quality = 0
+    for encoding in ENCODINGS:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+def compress(data, encoding):
+    """一次壓縮整個回應內容"""
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # wbits=31 為 gzip 格式（標頭不含時間戳記，相同內容的輸出相同）
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def iter_compressed(chunks, encoding):
+    """逐段壓縮串流回應，每段都 flush，讓用戶端立即收到已產生的內容"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process = compressor.process
+        flush = compressor.flush
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+def tag_etag(etag_header, encoding):
+    """在 ETag 加上壓縮方式的後綴"""
+    etag, weak = unquote_etag(etag_header)
+    return quote_etag(etag + ETAG_SUFFIXES[encoding], weak)
+
+def not_modified_etag(etag_header, encoding, if_none_match):
+    """304 回應的 ETag：用戶端持有的是壓縮版本時回傳加上後綴的 ETag，否則維持原樣"""
+    if encoding is None or not if_none_match:
+        return etag_header
+    
+    etag, weak = unquote_etag(etag_header)
+    if parse_etags(if_none_match).contains_weak(etag + ETAG_SUFFIXES[encoding]):
+        return quote_etag(etag + ETAG_SUFFIXES[encoding], weak)
+    return etag_header
+
+def compress_response(response):
+    """after_request：/api/* 與匯出路由依 Accept-Encoding 壓縮回應"""
+    if not request.path.startswith(COMPRESS_PATHS):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    
+    if response.status_code == 304:
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = not_modified_etag(
+                response.headers['ETag'], encoding, request.headers.get('If-None-Match')
+            )
+        return response
+    
+    if (response.status_code < 200 or response.status_code in (204, 206)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype in SKIP_MIMETYPES):
+        return response
+    
+    if response.is_streamed:
+        # 原本的可迭代物件（例如 stream_with_context）仍需在回應結束時關閉
+        original = response.response
+        response.response = iter_compressed(original, encoding)
+        if hasattr(original, 'close'):
+            response.call_on_close(original.close)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    
+    response.headers['Content-Encoding'] = encoding
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = tag_etag(response.headers['ETag'], encoding)
+    return response
+
+def init_encoding(app):
+    """在 Flask app 註冊 JSON provider 與回應壓縮"""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+
+def encoding_stats():
+    return {
+        "json_backend": json_backend,
+        "compression": list(ENCODINGS),
+        "min_size": COMPRESS_MIN_SIZE
+    }
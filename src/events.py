@@ -0,0 +1,230 @@
+"""
+房間變更的即時推送（Server-Sent Events）
+
+寫入路由在 commit 後呼叫 broker.publish()，同一個行程內訂閱該房間的連線會立即收到事件；
+事件的 id 是房間的版本號（rooms.version），頁面依版本號判斷是否漏接事件。
+其他 worker 行程的寫入不會經過這個行程的 broker，由連線每 EVENTS_POLL_SECONDS 秒比對 rooms.version
+發現，改送 reset 讓頁面重新載入。
+
+事件類型：
+- expense_added / expense_updated：{"version", "expense", "totals", "settlement"}
+- expense_deleted：{"version", "expense_id", "totals", "settlement"}
+- room_updated：成員變動，{"version"}
+- reset：無法以增量表示的變更（批次建立、匯入、其他行程的寫入），{"version"}
+- room_deleted：房間已刪除或已無權限，連線隨即結束
+"""
+import collections
+import os
+import threading
+import time
+from auth import can_access_room
+from encoding import dumps
+from models import get_room_version
+
+# 沒有事件時送出 keepalive 並重新檢查房間版本與權限的間隔（秒）
+EVENTS_KEEPALIVE = int(os.getenv("EVENTS_KEEPALIVE", "15"))
+# 沒有事件時比對房間版本的間隔（秒），用來發現其他 worker 行程的寫入
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "2"))
+# 每條連線的最長秒數，到期後結束串流，瀏覽器的 EventSource 會帶著 Last-Event-ID 自動重新連線
+EVENTS_STREAM_SECONDS = int(os.getenv("EVENTS_STREAM_SECONDS", "300"))
+# WSGI 模式每個行程同時保持的事件串流上限（每條串流占用一條 worker 執行緒）
+EVENTS_MAX_STREAMS = int(os.getenv("EVENTS_MAX_STREAMS", "4"))
+# 每條連線最多累積的未送出事件，超過時捨棄並改送 reset
+EVENTS_QUEUE_SIZE = 64
+# 瀏覽器斷線後重新連線的等待時間（毫秒）
+EVENTS_RETRY_MS = 3000
+
+KEEPALIVE = ": keepalive\n\n"
+
+def format_event(event_type, payload, version=None):
+    """組成一個 SSE 事件，payload 為已序列化的 JSON 字串"""
+    lines = []
+    if version is not None:
+        lines.append(f"id: {version}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+def parse_version(value):
+    """解析 Last-Event-ID 或 since 參數，無法解析時回傳 None"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class Subscription:
+    """一條連線訂閱的事件佇列"""
+    
+    def __init__(self, room_id, notify=None):
+        self.room_id = room_id
+        # notify() 在發布事件的執行緒呼叫（ASGI 用來喚醒事件迴圈）
+        self.notify = notify
+        self.events = collections.deque()
+        self.overflow = False
+        self.condition = threading.Condition()
+    
+    def put(self, event):
+        with self.condition:
+            if len(self.events) >= EVENTS_QUEUE_SIZE:
+                self.events.clear()
+                self.overflow = True
+            elif not self.overflow:
+                self.events.append(event)
+            self.condition.notify()
+        if self.notify is not None:
+            self.notify()
+    
+    def drain(self):
+        """取出所有待送事件；佇列曾經滿出時回傳 None（需要改送 reset）"""
+        with self.condition:
+            return self._take()
+    
+    def wait(self, timeout):
+        """阻塞等待事件（WSGI 用），逾時回傳空列表"""
+        with self.condition:
+            if not self.events and not self.overflow:
+                self.condition.wait(timeout)
+            return self._take()
+    
+    def _take(self):
+        if self.overflow:
+            self.overflow = False
+            return None
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+class EventBroker:
+    """行程內的房間事件發布與訂閱"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}
+        self.published = 0
+    
+    def subscribe(self, room_id, notify=None, limit=None):
+        """訂閱房間事件；limit 為同時連線數上限，超過時回傳 None"""
+        with self.lock:
+            if limit is not None and self._count() >= limit:
+                return None
+            subscription = Subscription(room_id, notify)
+            self.rooms.setdefault(room_id, set()).add(subscription)
+            return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.rooms.get(subscription.room_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.rooms[subscription.room_id]
+    
+    def has_subscribers(self, room_id):
+        """房間是否有連線訂閱（沒有時呼叫端可以省略組成事件內容的查詢）"""
+        return room_id in self.rooms
+    
+    def publish(self, room_id, version, event_type, data):
+        """發布事件給房間的所有訂閱者，事件內容只序列化一次"""
+        with self.lock:
+            subscribers = list(self.rooms.get(room_id, ()))
+            if subscribers:
+                self.published += 1
+        if not subscribers:
+            return
+        
+        payload = dumps(data)
+        for subscription in subscribers:
+            subscription.put((version, event_type, payload))
+    
+    def _count(self):
+        return sum(len(subscribers) for subscribers in self.rooms.values())
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "rooms": len(self.rooms),
+                "streams": self._count(),
+                "published": self.published
+            }
+
+broker = EventBroker()
+
+class RoomStream:
+    """
+    一條事件串流的狀態：記錄已送給頁面的版本號，決定要送出的內容
+    
+    check() 與 idle() 會查詢資料庫，ASGI 需在執行緒池中呼叫；render() 不查詢資料庫
+    """
+    
+    def __init__(self, email, room_id, version):
+        self.email = email
+        self.room_id = room_id
+        self.version = version
+        self.closed = False
+        self.next_check = 0
+    
+    def check(self):
+        """確認權限與房間版本：版本與已送出的不同時送 reset，否則送 keepalive"""
+        self.next_check = time.monotonic() + EVENTS_KEEPALIVE
+        current = get_room_version(self.room_id)
+        if current is None or not can_access_room(self.email, self.room_id):
+            self.closed = True
+            return format_event("room_deleted", "{}")
+        
+        if current != self.version:
+            self.version = current
+            return format_event("reset", dumps({"version": current}), current)
+        return KEEPALIVE
+    
+    def idle(self):
+        """等待事件逾時時呼叫：只比對房間版本，每 EVENTS_KEEPALIVE 秒才執行完整的 check()"""
+        if time.monotonic() >= self.next_check:
+            return self.check()
+        
+        current = get_room_version(self.room_id)
+        if current is None:
+            return self.check()
+        if current != self.version:
+            self.version = current
+            return format_event("reset", dumps({"version": current}), current)
+        return ""
+    
+    def render(self, events):
+        """將 broker 送來的事件組成 SSE 文字，略過版本已送出過的事件"""
+        chunks = []
+        for version, event_type, payload in events:
+            if version is not None:
+                if self.version is not None and version <= self.version:
+                    continue
+                self.version = version
+            chunks.append(format_event(event_type, payload, version))
+            if event_type == "room_deleted":
+                self.closed = True
+                break
+        return "".join(chunks)
+    
+    def opening(self):
+        """串流開頭：重新連線間隔，並以 check() 補上連線前錯過的變更"""
+        return f"retry: {EVENTS_RETRY_MS}\n\n" + self.check()
+
+def iter_stream(stream, subscription):
+    """WSGI 用：阻塞等待事件，逐段產生 SSE 文字，EVENTS_STREAM_SECONDS 後結束"""
+    deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+    yield stream.opening()
+    
+    while not stream.closed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        
+        events = subscription.wait(min(EVENTS_POLL_SECONDS, remaining))
+        if events:
+            text = stream.render(events)
+        elif events is None:
+            # 佇列滿出：比對資料庫的版本
+            text = stream.check()
+        else:
+            text = stream.idle()
+        if text:
+            yield text
@@ -0,0 +1,247 @@
+import csv
+import json
+import os
+import re
+from datetime import datetime
+from database import get_db, begin_immediate
+from models import parse_expense, check_expense_members, insert_expenses, bump_room_version
+from calculations import apply_expenses
+
+# 每個交易寫入的支出筆數
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+# CSV 標題對應的欄位（支援匯出檔的中文標題與英文標題）
+HEADER_ALIASES = {
+    "date": ("日期", "date", "created_at"),
+    "title": ("標題", "title"),
+    "amount": ("金額", "amount"),
+    "payer": ("付款人", "payer"),
+    "participants": ("參與者", "participants"),
+}
+REQUIRED_COLUMNS = ("title", "amount", "payer", "participants")
+
+# 匯出檔在標題列之前有房間資訊等說明列，最多略過這麼多列
+MAX_PREAMBLE_ROWS = 20
+
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+_PARTICIPANT_SPLIT = re.compile(r"[,;，、]")
+
+class ImportFormatError(Exception):
+    """匯入檔案格式錯誤，無法繼續解析"""
+    pass
+
+def detect_format(filename=None, content_type=None):
+    """依副檔名或 Content-Type 判斷格式，預設為 csv"""
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if content_type and ("ndjson" in content_type or "jsonl" in content_type):
+        return "jsonl"
+    return "csv"
+
+class MemberResolver:
+    """把 email 或名稱對應到房間成員的 email（整個匯入只查詢一次）"""
+    
+    def __init__(self, cursor, room_id):
+        cursor.execute("""
+            SELECT rm.email, u.name
+            FROM room_members rm
+            LEFT JOIN users u ON u.email = rm.email
+            WHERE rm.room_id = ?
+        """, (room_id,))
+        
+        self.members = set()
+        self._names = {}
+        self._ambiguous = set()
+        for email, name in cursor.fetchall():
+            self.members.add(email)
+            if name and name.strip():
+                key = name.strip().lower()
+                if key in self._names and self._names[key] != email:
+                    self._ambiguous.add(key)
+                self._names[key] = email
+    
+    def resolve(self, value):
+        """回傳 (email, error)"""
+        key = value.strip().lower()
+        if key in self.members:
+            return key, None
+        if key in self._ambiguous:
+            return None, f"名稱「{value.strip()}」對應到多位成員，請改用 email"
+        if key in self._names:
+            return self._names[key], None
+        return None, f"找不到房間成員：{value.strip()}"
+
+def iter_csv_records(lines):
+    """
+    逐列解析 CSV，產生 (行號, 欄位 dict)
+    
+    會略過標題列之前的說明列，因此可以直接匯入 export_expenses 產生的檔案
+    """
+    reader = csv.reader(lines)
+    columns = None
+    
+    for row in reader:
+        if columns is None:
+            cells = [cell.strip().lstrip('\ufeff').lower() for cell in row]
+            found = {}
+            for field, aliases in HEADER_ALIASES.items():
+                for alias in aliases:
+                    if alias.lower() in cells:
+                        found[field] = cells.index(alias.lower())
+                        break
+            if all(field in found for field in REQUIRED_COLUMNS):
+                columns = found
+            elif reader.line_num > MAX_PREAMBLE_ROWS:
+                raise ImportFormatError("找不到標題列（需要：標題、金額、付款人、參與者）")
+            continue
+        
+        if not any(cell.strip() for cell in row):
+            continue
+        
+        yield reader.line_num, {
+            field: row[index] if index < len(row) else ""
+            for field, index in columns.items()
+        }
+    
+    if columns is None:
+        raise ImportFormatError("找不到標題列（需要：標題、金額、付款人、參與者）")
+
+def iter_jsonl_records(lines):
+    """逐行解析 JSON Lines，產生 (行號, 欄位 dict 或錯誤訊息)"""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, "JSON 格式錯誤"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "每行必須是一個 JSON 物件"
+            continue
+        yield line_number, record
+
+def normalize_record(record, resolver):
+    """
+    把一筆匯入資料轉換成支出，名稱與 email 會對應到房間成員
+    
+    回傳 (expense, error)
+    """
+    payer = record.get("payer") or ""
+    participants = record.get("participants") or []
+    amount = record.get("amount", 0)
+    created_at = record.get("date") or record.get("created_at")
+    
+    if isinstance(participants, str):
+        participants = [p for p in _PARTICIPANT_SPLIT.split(participants) if p.strip()]
+    if isinstance(amount, str) and re.fullmatch(r"\s*\d+\s*", amount):
+        amount = int(amount)
+    
+    if not isinstance(payer, str) or not payer.strip():
+        return None, "請輸入有效的付款人 email"
+    payer, error = resolver.resolve(payer)
+    if error:
+        return None, error
+    
+    if not isinstance(participants, list):
+        return None, "參與者格式錯誤"
+    resolved = []
+    for participant in participants:
+        if not isinstance(participant, str):
+            return None, "參與者格式錯誤"
+        email, error = resolver.resolve(participant)
+        if error:
+            return None, error
+        resolved.append(email)
+    
+    expense, error = parse_expense({
+        "title": record.get("title", ""),
+        "amount": amount,
+        "payer": payer,
+        "participants": resolved
+    })
+    if error:
+        return None, error
+    
+    error = check_expense_members(expense, resolver.members)
+    if error:
+        return None, error
+    
+    if created_at:
+        if not isinstance(created_at, str):
+            return None, "日期格式錯誤"
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(created_at.strip(), date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            return None, "日期格式錯誤，請使用 YYYY-MM-DD HH:MM:SS"
+        expense["created_at"] = parsed.strftime("%Y-%m-%d %H:%M:%S")
+    
+    return expense, None
+
+def import_expenses(room_id, lines, file_format="csv", chunk_size=None):
+    """
+    串流匯入支出記錄
+    
+    lines 為逐行產生文字的可迭代物件（檔案或請求串流），不會整份載入記憶體。
+    每 chunk_size 筆寫入一個交易，依序產生事件：
+    - {"line": 行號, "error": 錯誤訊息}：該行未匯入
+    - {"progress": {"lines", "imported", "failed"}}：每個交易提交後
+    - {"done": {"lines", "imported", "failed"}}：結束（格式錯誤時另含 "error"）
+    """
+    if chunk_size is None:
+        chunk_size = IMPORT_CHUNK_SIZE
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    resolver = MemberResolver(cursor, room_id)
+    
+    stats = {"lines": 0, "imported": 0, "failed": 0}
+    chunk = []
+    
+    def flush():
+        begin_immediate(conn)
+        insert_expenses(cursor, room_id, chunk)
+        apply_expenses(cursor, room_id, [
+            (expense["amount"], expense["payer"], expense["participants"])
+            for expense in chunk
+        ])
+        bump_room_version(cursor, room_id)
+        conn.commit()
+        stats["imported"] += len(chunk)
+        chunk.clear()
+    
+    records = iter_jsonl_records(lines) if file_format == "jsonl" else iter_csv_records(lines)
+    try:
+        for line_number, record in records:
+            stats["lines"] += 1
+            if isinstance(record, str):
+                expense, error = None, record
+            else:
+                expense, error = normalize_record(record, resolver)
+            
+            if error:
+                stats["failed"] += 1
+                yield {"line": line_number, "error": error}
+                continue
+            
+            chunk.append(expense)
+            if len(chunk) >= chunk_size:
+                flush()
+                yield {"progress": dict(stats)}
+    except (ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+        if chunk:
+            flush()
+        yield {"done": dict(stats), "error": str(e)}
+        return
+    
+    if chunk:
+        flush()
+        yield {"progress": dict(stats)}
+    
+    yield {"done": dict(stats)}
@@ -0,0 +1,251 @@
+import os
+import queue
+import threading
+import time
+from database import get_db
+from mailer import SMTPSession, check_credentials, send_otp_email, otp_body, OTP_SUBJECT
+
+# 寄送方式：
+# queue  寫入 mail_outbox 由背景執行緒寄出（預設）
+# pooled 請求中直接寄出，但重複使用連線池中的 SMTP 連線
+# sync   請求中直接寄出，每封建立一條新連線
+MAIL_DELIVERY = os.getenv("MAIL_DELIVERY", "queue")
+
+# pooled 模式的連線數上限，以及連線都在使用中時等待歸還的最長秒數
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "4"))
+MAIL_POOL_TIMEOUT = float(os.getenv("MAIL_POOL_TIMEOUT", "10"))
+
+# 重試設定：第 n 次失敗後等待 MAIL_RETRY_BASE * 2^(n-1) 秒，最多 MAIL_RETRY_MAX 秒
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "5"))
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "300"))
+
+# 取出寄送時的租約秒數，行程中途結束時租約到期後會重新寄送
+MAIL_LEASE_SECONDS = float(os.getenv("MAIL_LEASE_SECONDS", "120"))
+# 背景執行緒每次取出的筆數與沒有新郵件時的輪詢間隔
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "5"))
+
+# 取出到期的郵件並延後 next_attempt_at 作為租約
+CLAIM_QUERY = """
+    UPDATE mail_outbox
+    SET attempts = attempts + 1, next_attempt_at = ?
+    WHERE id IN (
+        SELECT id FROM mail_outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+    )
+    RETURNING id, recipient, subject, body, attempts
+"""
+
+def retry_delay(attempts):
+    """第 attempts 次失敗後的等待秒數（指數退避）"""
+    return min(MAIL_RETRY_BASE * (2 ** (attempts - 1)), MAIL_RETRY_MAX)
+
+def enqueue_mail(recipient, subject, body):
+    """將郵件寫入寄送佇列並喚醒背景執行緒"""
+    check_credentials()
+    
+    now = time.time()
+    conn = get_db()
+    conn.execute(
+        """
+        INSERT INTO mail_outbox (recipient, subject, body, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (recipient, subject, body, now, now)
+    )
+    conn.commit()
+    
+    if _worker is not None:
+        _worker.wake()
+
+class SessionPool:
+    """pooled 模式使用的 SMTP 連線池，最多 size 條連線，用完歸還"""
+    
+    def __init__(self, size=MAIL_POOL_SIZE, timeout=MAIL_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._timeouts = 0
+    
+    def _acquire(self):
+        """借出一條連線；連線都在使用中（例如 SMTP 伺服器沒有回應）時最多等待 timeout 秒，逾時拋出 TimeoutError"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if len(self._sessions) < self.size:
+                session = SMTPSession()
+                self._sessions.append(session)
+                return session
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"No SMTP session available within {self.timeout} seconds")
+    
+    def send(self, recipient, subject, body):
+        """借一條連線寄出郵件，失敗時拋出例外"""
+        session = self._acquire()
+        try:
+            session.send(recipient, subject, body)
+        except Exception:
+            session.close()
+            raise
+        finally:
+            self._idle.put(session)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "sessions": len(self._sessions),
+                "timeouts": self._timeouts,
+                "smtp_connects": sum(session.connects for session in self._sessions)
+            }
+
+_session_pool = SessionPool()
+
+def deliver_otp(email, otp):
+    """依 MAIL_DELIVERY 設定寄出 OTP（queue 模式只寫入佇列就返回）"""
+    if MAIL_DELIVERY == "sync":
+        return send_otp_email(email, otp)
+    
+    if MAIL_DELIVERY == "pooled":
+        check_credentials()
+        try:
+            _session_pool.send(email, OTP_SUBJECT, otp_body(otp))
+            return True
+        except Exception as e:
+            print(f"Email sending error: {e}")
+            return False
+    
+    enqueue_mail(email, OTP_SUBJECT, otp_body(otp))
+    return True
+
+class MailWorker(threading.Thread):
+    """從 mail_outbox 取出到期的郵件，以持續連線寄出，失敗時依指數退避重試"""
+    
+    def __init__(self):
+        super().__init__(name="mail-worker", daemon=True)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self.session = SMTPSession()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+    
+    def wake(self):
+        """有新郵件時提早開始下一輪"""
+        self._wakeup.set()
+    
+    def stop(self):
+        """停止執行緒並關閉 SMTP 連線"""
+        self._stopping.set()
+        self._wakeup.set()
+    
+    def claim(self, conn):
+        """取出到期的郵件並延後 next_attempt_at 作為租約"""
+        now = time.time()
+        cursor = conn.execute(CLAIM_QUERY, (now + MAIL_LEASE_SECONDS, now, MAIL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    
+    def deliver(self, conn, row):
+        """寄出一封郵件並更新佇列狀態"""
+        mail_id, recipient, subject, body, attempts = row
+        try:
+            self.session.send(recipient, subject, body)
+        except Exception as e:
+            self.session.close()
+            if attempts >= MAIL_MAX_ATTEMPTS:
+                # 放棄寄送時清除內容，驗證碼不留在佇列中（只保留收件人與錯誤供排查）
+                conn.execute(
+                    "UPDATE mail_outbox SET status = 'failed', body = '', last_error = ? WHERE id = ?",
+                    (str(e), mail_id)
+                )
+                self.failed += 1
+                print(f"Email sending error (giving up after {attempts} attempts): {e}")
+            else:
+                conn.execute(
+                    "UPDATE mail_outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (time.time() + retry_delay(attempts), str(e), mail_id)
+                )
+                self.retried += 1
+            conn.commit()
+            return
+        
+        # 寄出後即刪除，驗證碼不留在佇列中
+        conn.execute("DELETE FROM mail_outbox WHERE id = ?", (mail_id,))
+        conn.commit()
+        self.sent += 1
+    
+    def run(self):
+        conn = get_db()
+        while not self._stopping.is_set():
+            try:
+                rows = self.claim(conn)
+                for row in rows:
+                    self.deliver(conn, row)
+            except Exception as e:
+                print(f"Mail worker error: {e}")
+                rows = []
+                if conn.in_transaction:
+                    conn.rollback()
+            
+            # 這一輪取滿時可能還有到期的郵件，直接進入下一輪
+            if len(rows) < MAIL_BATCH_SIZE:
+                self._wakeup.wait(MAIL_POLL_INTERVAL)
+                self._wakeup.clear()
+        
+        self.session.close()
+    
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "smtp_connects": self.session.connects
+        }
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_mail_worker():
+    """啟動背景寄送執行緒（每個行程只啟動一次，sync 與 pooled 模式不啟動）"""
+    global _worker
+    if MAIL_DELIVERY in ("sync", "pooled") or _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            worker = MailWorker()
+            worker.start()
+            _worker = worker
+
+def mail_stats():
+    """寄送佇列深度與背景執行緒統計"""
+    cursor = get_db().cursor()
+    cursor.execute("SELECT status, COUNT(*), MIN(created_at) FROM mail_outbox GROUP BY status")
+    counts = {"pending": 0, "failed": 0}
+    oldest_pending = None
+    for status, count, oldest in cursor.fetchall():
+        counts[status] = count
+        if status == 'pending':
+            oldest_pending = oldest
+    
+    return {
+        "delivery": MAIL_DELIVERY,
+        "queue_depth": counts["pending"],
+        "failed": counts["failed"],
+        "oldest_pending_seconds": round(time.time() - oldest_pending, 1) if oldest_pending else None,
+        "worker": _worker.stats() if _worker is not None else None,
+        "pool": _session_pool.stats() if MAIL_DELIVERY == "pooled" else None
+    }
@@ -1,8 +1,11 @@
 import smtplib
 import os
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
+from otp_store import OTP_TTL_SECONDS
 
 # 從 ENV/.env 載入環境變數
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ENV', '.env')
@@ -12,35 +15,132 @@ SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
+MAIL_FROM = SMTP_USER or "splitwise@localhost"
 
-def send_otp_email(email, otp):
-    """發送 OTP 驗證碼到指定 email"""
+# 持續連線閒置超過這個秒數就先關閉，避免被伺服器斷線
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# 設為 1 時改寄到本機 SMTP 接收端（smtp_sink.py），不需要帳號密碼也不使用 TLS；
+# 接收端尚未啟動時會在此行程內自動啟動
+SMTP_SINK = os.getenv("SMTP_SINK", "0") == "1"
+
+OTP_SUBJECT = "分帳工具驗證碼"
+
+def check_credentials():
+    """確認 SMTP 帳號密碼已設定"""
+    if SMTP_SINK:
+        return
     if not SMTP_USER or not SMTP_PASS:
         raise ValueError("SMTP credentials not configured in .env")
+
+def otp_body(otp):
+    """OTP 郵件內容"""
+    return f"""
+    您的驗證碼是：{otp}
     
+    此驗證碼將在 {OTP_TTL_SECONDS // 60} 分鐘後過期。
+    請勿將此驗證碼分享給他人。
+    """
+
+def build_message(recipient, subject, body):
+    """建立郵件內容，回傳可直接寄出的字串"""
     msg = MIMEMultipart()
-    msg['From'] = SMTP_USER
-    msg['To'] = email
-    msg['Subject'] = "分帳工具驗證碼"
+    msg['From'] = MAIL_FROM
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg.as_string()
+
+_sink = None
+_sink_lock = threading.Lock()
+
+def _open_sink():
+    """連到本機 SMTP 接收端，第一次使用時若沒有接收端在執行就自行啟動"""
+    global _sink
+    from smtp_sink import start_sink, SMTP_SINK_HOST, SMTP_SINK_PORT
     
-    body = f"""
-    您的驗證碼是：{otp}
+    with _sink_lock:
+        if _sink is None:
+            try:
+                _sink = start_sink()
+            except OSError:
+                # 連接埠已被使用：已有獨立執行的接收端
+                _sink = False
+    return smtplib.SMTP(SMTP_SINK_HOST, SMTP_SINK_PORT, timeout=SMTP_TIMEOUT)
+
+def open_smtp():
+    """建立 SMTP 連線並完成 STARTTLS 與登入"""
+    if SMTP_SINK:
+        return _open_sink()
     
-    此驗證碼將在 10 分鐘後過期。
-    請勿將此驗證碼分享給他人。
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    server.starttls()
+    server.login(SMTP_USER, SMTP_PASS)
+    return server
+
+class SMTPSession:
     """
+    持續使用的 SMTP 連線
     
-    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    第一次寄信時才連線，之後重複使用；連線中斷時自動重連一次，
+    閒置超過 SMTP_IDLE_TIMEOUT 秒則先關閉。非執行緒安全，由單一執行緒使用。
+    """
+    
+    def __init__(self, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0
+        self.connects = 0
+    
+    def _connect(self):
+        self.close()
+        self._server = open_smtp()
+        self.connects += 1
+    
+    def send(self, recipient, subject, body):
+        """寄出一封郵件，失敗時拋出例外"""
+        check_credentials()
+        
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        
+        message = build_message(recipient, subject, body)
+        reused = self._server is not None
+        if not reused:
+            self._connect()
+        
+        try:
+            self._server.sendmail(MAIL_FROM, recipient, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # 沿用的連線可能已被伺服器關閉，重連後再試一次
+            if not reused:
+                self.close()
+                raise
+            self._connect()
+            self._server.sendmail(MAIL_FROM, recipient, message)
+        
+        self._last_used = time.monotonic()
+    
+    def close(self):
+        """關閉連線"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+def send_otp_email(email, otp):
+    """發送 OTP 驗證碼到指定 email（每封建立一條新連線）"""
+    check_credentials()
     
     try:
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        text = msg.as_string()
-        server.sendmail(SMTP_USER, email, text)
+        server = open_smtp()
+        server.sendmail(MAIL_FROM, email, build_message(email, OTP_SUBJECT, otp_body(otp)))
         server.quit()
         return True
     except Exception as e:
         print(f"Email sending error: {e}")
         return False
-
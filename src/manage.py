@@ -0,0 +1,104 @@
+import argparse
+import sys
+from database import init_db, get_db, get_schema_version
+
+def check_plans(args):
+    """檢查熱門查詢是否使用索引"""
+    from query_plans import find_full_scans, HOT_QUERIES
+    
+    problems = find_full_scans(get_db())
+    if not problems:
+        print(f"全部 {len(HOT_QUERIES)} 個查詢皆使用索引")
+        return 0
+    
+    for name, detail in problems:
+        print(f"全表掃描：{name} -> {detail}")
+    return 1
+
+def check_balances(args):
+    """比對餘額彙總表與支出記錄，--fix 時重建不一致的房間"""
+    from calculations import check_balances as find_balance_diffs, rebuild_room_balances
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    diffs = find_balance_diffs(cursor, [args.room] if args.room else None)
+    if not diffs:
+        print("餘額彙總表與支出記錄一致")
+        return 0
+    
+    for diff in diffs:
+        print(f"{diff['room_id']} {diff['email']}: 應為 {diff['expected']}，實際為 {diff['actual']}")
+    
+    if not args.fix:
+        return 1
+    
+    for room_id in sorted({diff['room_id'] for diff in diffs}):
+        rebuild_room_balances(cursor, room_id)
+    conn.commit()
+    print(f"已重建 {len({diff['room_id'] for diff in diffs})} 個房間的餘額彙總")
+    return 0
+
+def import_file(args):
+    """從 CSV 或 JSON Lines 檔案匯入支出記錄"""
+    from importer import import_expenses, detect_format
+    
+    cursor = get_db().cursor()
+    cursor.execute("SELECT id FROM rooms WHERE id=?", (args.room,))
+    if not cursor.fetchone():
+        print(f"房間不存在：{args.room}")
+        return 1
+    
+    file_format = args.format or detect_format(args.file)
+    with open(args.file, encoding='utf-8-sig', newline='') as f:
+        for event in import_expenses(args.room, f, file_format, args.chunk_size):
+            if "error" in event and "line" in event:
+                print(f"第 {event['line']} 行：{event['error']}")
+            elif "progress" in event:
+                progress = event["progress"]
+                print(f"已處理 {progress['lines']} 行，匯入 {progress['imported']} 筆")
+            elif "done" in event:
+                done = event["done"]
+                if "error" in event:
+                    print(f"匯入中止：{event['error']}")
+                print(f"完成：共 {done['lines']} 行，匯入 {done['imported']} 筆，失敗 {done['failed']} 筆")
+                return 1 if done["failed"] or "error" in event else 0
+    return 0
+
+def migrate(args):
+    """套用尚未執行的遷移（由 main 先呼叫 init_db 完成），印出目前的 schema 版本"""
+    cursor = get_db().cursor()
+    print(f"資料庫 schema 版本：{get_schema_version(cursor)}")
+    return 0
+
+def main(argv=None):
+    """管理指令進入點"""
+    parser = argparse.ArgumentParser(description="Split-Wise 管理指令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    subparsers.add_parser("migrate", help="執行資料庫遷移（正式環境啟動時執行一次）")
+    subparsers.add_parser("check-plans", help="以 EXPLAIN QUERY PLAN 檢查熱門查詢是否全表掃描")
+    
+    balances_parser = subparsers.add_parser("check-balances", help="比對 room_balances 與支出記錄")
+    balances_parser.add_argument("--room", help="只檢查指定房間")
+    balances_parser.add_argument("--fix", action="store_true", help="重建不一致的房間")
+    
+    import_parser = subparsers.add_parser("import-expenses", help="從 CSV 或 JSON Lines 匯入支出記錄")
+    import_parser.add_argument("room", help="房間 ID")
+    import_parser.add_argument("file", help="CSV 或 JSON Lines 檔案")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="檔案格式（預設依副檔名判斷）")
+    import_parser.add_argument("--chunk-size", type=int, help="每個交易寫入的筆數")
+    
+    args = parser.parse_args(argv)
+    
+    init_db()
+    
+    commands = {
+        "migrate": migrate,
+        "check-plans": check_plans,
+        "check-balances": check_balances,
+        "import-expenses": import_file,
+    }
+    return commands[args.command](args)
+
+if __name__ == '__main__':
+    sys.exit(main())
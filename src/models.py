@@ -1,7 +1,9 @@
 import secrets
 import random
-from datetime import datetime, timedelta
+import base64
+import json
 from database import get_db
+from otp_store import otp_store
 
 def generate_room_id():
     """生成 8 位隨機房間 ID"""
@@ -11,15 +13,16 @@ def generate_otp():
     """生成 6 位數字 OTP"""
     return str(random.randint(100000, 999999))
 
+USER_EXISTS_QUERY = "SELECT email FROM users WHERE email=?"
+
 def create_user(email, name=None):
     """建立新使用者（如果不存在）"""
     conn = get_db()
     cursor = conn.cursor()
     
     # 檢查使用者是否已存在
-    cursor.execute("SELECT email FROM users WHERE email=?", (email,))
+    cursor.execute(USER_EXISTS_QUERY, (email,))
     if cursor.fetchone():
-        conn.close()
         return False
     
     # 建立新使用者
@@ -28,7 +31,6 @@ def create_user(email, name=None):
         (email, name, 1)
     )
     conn.commit()
-    conn.close()
     return True
 
 def update_user_name(email, name):
@@ -40,23 +42,27 @@ def update_user_name(email, name):
         "UPDATE users SET name=? WHERE email=?",
         (name, email)
     )
+    bump_member_rooms(cursor, email)
     conn.commit()
-    conn.close()
     return True
 
+USER_NAME_QUERY = "SELECT name FROM users WHERE email=?"
+
 def get_user_name(email):
     """取得使用者名稱，如果沒有則返回 email"""
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT name FROM users WHERE email=?", (email,))
+    cursor.execute(USER_NAME_QUERY, (email,))
     result = cursor.fetchone()
-    conn.close()
     
     if result and result[0]:
         return result[0]
     return email
 
+# {placeholders} 替換為與 email 數量相同的 ?
+USER_NAMES_QUERY = "SELECT email, name FROM users WHERE email IN ({placeholders})"
+
 def get_user_names(emails):
     """取得多個使用者的名稱映射"""
     if not emails:
@@ -66,8 +72,7 @@ def get_user_names(emails):
     cursor = conn.cursor()
     
     placeholders = ','.join(['?'] * len(emails))
-    query = "SELECT email, name FROM users WHERE email IN (" + placeholders + ")"
-    cursor.execute(query, emails)
+    cursor.execute(USER_NAMES_QUERY.format(placeholders=placeholders), emails)
     
     result = {}
     for row in cursor.fetchall():
@@ -75,8 +80,6 @@ def get_user_names(emails):
         name = row[1]
         result[email] = name if name else email
     
-    conn.close()
-    
     # 對於沒有找到的 email，使用 email 本身作為名稱
     for email in emails:
         if email not in result:
@@ -84,44 +87,385 @@ def get_user_names(emails):
     
     return result
 
-def save_otp(email, otp):
-    """儲存 OTP 到資料庫（10 分鐘有效）"""
+def bump_room_version(cursor, room_id):
+    """遞增房間版本號並更新最後修改時間（需在寫入支出或成員的同一個交易內呼叫），回傳新的版本號"""
+    cursor.execute("""
+        UPDATE rooms SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id=?
+        RETURNING version
+    """, (room_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+BUMP_MEMBER_ROOMS_QUERY = """
+    UPDATE rooms SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id IN (SELECT room_id FROM room_members WHERE email=?)
+"""
+
+def bump_member_rooms(cursor, email):
+    """遞增使用者所屬房間的版本號（使用者名稱會出現在這些房間的回應中）"""
+    cursor.execute(BUMP_MEMBER_ROOMS_QUERY, (email,))
+
+ROOM_VERSION_QUERY = "SELECT version FROM rooms WHERE id=?"
+ROOM_VALIDATORS_QUERY = "SELECT version, updated_at FROM rooms WHERE id=?"
+
+def get_room_version(room_id):
+    """取得房間目前的版本號，房間不存在時回傳 None"""
+    cursor = get_db().cursor()
+    cursor.execute(ROOM_VERSION_QUERY, (room_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def get_room_validators(room_id):
+    """取得房間的 (版本號, 最後修改時間 epoch 秒數)，房間不存在時回傳 None"""
+    cursor = get_db().cursor()
+    cursor.execute(ROOM_VALIDATORS_QUERY, (room_id,))
+    return cursor.fetchone()
+
+# 路由使用的查詢（manage.py check-plans 會檢查這些查詢的執行計畫）
+
+# 一般使用者的房間列表：自己擁有或參與的房間
+# 以 UNION 拆成兩段，各自使用 owner_email 與 room_members.email 的索引
+ROOMS_QUERY = """
+    SELECT id, name, owner_email, created_at, version
+    FROM rooms
+    WHERE owner_email = ?
+    UNION
+    SELECT r.id, r.name, r.owner_email, r.created_at, r.version
+    FROM room_members rm
+    JOIN rooms r ON r.id = rm.room_id
+    WHERE rm.email = ?
+    ORDER BY created_at DESC
+"""
+# 管理員的房間列表：所有房間
+ALL_ROOMS_QUERY = "SELECT id, name, owner_email, created_at, version FROM rooms ORDER BY created_at DESC"
+ROOM_QUERY = "SELECT id, name, owner_email, created_at, version FROM rooms WHERE id=?"
+ROOM_MEMBERS_QUERY = "SELECT email FROM room_members WHERE room_id=?"
+DELETE_ROOM_PARTICIPANTS_QUERY = """
+    DELETE FROM expense_participants
+    WHERE expense_id IN (SELECT id FROM expenses WHERE room_id=?)
+"""
+DELETE_ROOM_EXPENSES_QUERY = "DELETE FROM expenses WHERE room_id=?"
+EXPENSE_EXISTS_QUERY = "SELECT id FROM expenses WHERE id=? AND room_id=?"
+
+ALL_USERS_QUERY = "SELECT email, name, verified, created_at FROM users ORDER BY created_at DESC"
+# 刪除使用者：付款人是該使用者的支出所在的房間（需要重建餘額）
+PAYER_ROOMS_QUERY = "SELECT DISTINCT room_id FROM expenses WHERE payer_email=?"
+# 刪除使用者：使用者參與的房間（需要遞增版本號）
+MEMBER_ROOMS_QUERY = "SELECT room_id FROM room_members WHERE email=?"
+DELETE_USER_MEMBERSHIPS_QUERY = "DELETE FROM room_members WHERE email=?"
+# 刪除使用者：移除他在自己付款的支出中的參與紀錄
+DELETE_PAYER_PARTICIPANTS_QUERY = """
+    DELETE FROM expense_participants
+    WHERE email=? AND expense_id IN (SELECT id FROM expenses WHERE payer_email=?)
+"""
+DELETE_OWNED_ROOMS_QUERY = "DELETE FROM rooms WHERE owner_email=?"
+DELETE_USER_QUERY = "DELETE FROM users WHERE email=?"
+
+def parse_expense(data):
+    """
+    驗證支出欄位（建立、更新與批次建立共用）
+    
+    回傳 (expense, error)：expense 為 {"title", "amount", "payer", "participants"}，
+    驗證失敗時 expense 為 None、error 為錯誤訊息
+    """
+    if not isinstance(data, dict):
+        return None, "支出資料格式錯誤"
+    
+    title = data.get('title', '')
+    amount = data.get('amount', 0)
+    payer = data.get('payer', '')
+    participants = data.get('participants', [])
+    
+    if not isinstance(title, str) or not title.strip():
+        return None, "支出標題不能為空"
+    
+    # JSON 的 12.0 等整數值的浮點數視為整數；金額以整數儲存，不接受小數
+    if isinstance(amount, float) and amount.is_integer():
+        amount = int(amount)
+    
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        return None, "支出金額必須是整數（不接受小數）"
+    
+    if amount <= 0:
+        return None, "支出金額必須大於 0"
+    
+    if not isinstance(payer, str) or '@' not in payer:
+        return None, "請輸入有效的付款人 email"
+    
+    if not isinstance(participants, list) or len(participants) == 0:
+        return None, "至少需要一個參與者"
+    
+    if not all(isinstance(p, str) for p in participants):
+        return None, "參與者格式錯誤"
+    
+    # 轉換 email 為小寫
+    return {
+        "title": title.strip(),
+        "amount": amount,
+        "payer": payer.strip().lower(),
+        "participants": [p.strip().lower() for p in participants]
+    }, None
+
+# {placeholders} 替換為與 email 數量相同的 ?
+MEMBER_SET_QUERY = "SELECT email FROM room_members WHERE room_id=? AND email IN ({placeholders})"
+
+def get_member_set(cursor, room_id, emails):
+    """以單一查詢取得 emails 中屬於房間成員的集合"""
+    emails = list(set(emails))
+    if not emails:
+        return set()
+    
+    # 使用參數化查詢，避免 SQL injection
+    placeholders = ','.join(['?'] * len(emails))
+    cursor.execute(MEMBER_SET_QUERY.format(placeholders=placeholders), (room_id,) + tuple(emails))
+    return {row[0] for row in cursor.fetchall()}
+
+def check_expense_members(expense, members):
+    """檢查付款人與參與者是否都是房間成員（參與者不可重複），回傳錯誤訊息或 None"""
+    if expense["payer"] not in members:
+        return "付款人必須是房間成員"
+    
+    participants = expense["participants"]
+    if len(set(participants)) != len(participants) or not members.issuperset(participants):
+        return "所有參與者必須是房間成員"
+    
+    return None
+
+def insert_expenses(cursor, room_id, expenses):
+    """
+    以 executemany 寫入多筆支出與參與者，回傳依序配給的支出 id
+    
+    expenses 為 [{"title", "amount", "payer", "participants"}, ...]，
+    可選的 "created_at"（YYYY-MM-DD HH:MM:SS）未提供時使用目前時間。
+    id 由程式直接配給，呼叫端需先以 begin_immediate 取得寫入鎖，避免與其他寫入衝突。
+    """
+    if not expenses:
+        return []
+    
+    # AUTOINCREMENT 不重複使用已刪除的 id，因此同時參考 sqlite_sequence
+    cursor.execute("""
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name='expenses'), 0),
+            COALESCE((SELECT MAX(id) FROM expenses), 0)
+        )
+    """)
+    first_id = cursor.fetchone()[0] + 1
+    expense_ids = list(range(first_id, first_id + len(expenses)))
+    
+    cursor.executemany(
+        """
+        INSERT INTO expenses (id, room_id, title, amount, payer_email, created_at)
+        VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        [
+            (expense_id, room_id, expense["title"], expense["amount"], expense["payer"],
+             expense.get("created_at"))
+            for expense_id, expense in zip(expense_ids, expenses)
+        ]
+    )
+    cursor.executemany(
+        "INSERT INTO expense_participants (expense_id, email) VALUES (?, ?)",
+        [
+            (expense_id, participant_email)
+            for expense_id, expense in zip(expense_ids, expenses)
+            for participant_email in expense["participants"]
+        ]
+    )
+    
+    return expense_ids
+
+def encode_cursor(created_at, expense_id):
+    """將分頁位置 (created_at, id) 編碼為不透明的游標字串"""
+    raw = json.dumps([created_at, expense_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor_str):
+    """解析分頁游標，格式錯誤時回傳 None"""
+    try:
+        padded = cursor_str + '=' * (-len(cursor_str) % 4)
+        created_at, expense_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(created_at, str) or not isinstance(expense_id, int):
+        return None
+    return created_at, expense_id
+
+# {placeholders} 替換為與支出數量相同的 ?
+EXPENSE_PARTICIPANTS_QUERY = """
+    SELECT ep.expense_id, ep.email, u.name
+    FROM expense_participants ep
+    LEFT JOIN users u ON u.email = ep.email
+    WHERE ep.expense_id IN ({placeholders})
+    ORDER BY ep.expense_id, ep.email
+"""
+
+def get_expense_participants(expense_ids):
+    """
+    一次取得多筆支出的參與者（含名稱）
+    
+    回傳 {expense_id: [(email, name), ...]}，參與者依 email 排序
+    """
+    if not expense_ids:
+        return {}
+    
     conn = get_db()
     cursor = conn.cursor()
     
-    expires_at = datetime.now() + timedelta(minutes=10)
+    placeholders = ','.join(['?'] * len(expense_ids))
+    cursor.execute(EXPENSE_PARTICIPANTS_QUERY.format(placeholders=placeholders), list(expense_ids))
     
-    # 刪除舊的 OTP
-    cursor.execute("DELETE FROM login_tokens WHERE email=?", (email,))
+    result = {}
+    for expense_id, email, name in cursor.fetchall():
+        result.setdefault(expense_id, []).append((email, name if name else email))
     
-    # 插入新 OTP
-    cursor.execute(
-        "INSERT INTO login_tokens (email, otp, expires_at) VALUES (?, ?, ?)",
-        (email, otp, expires_at)
-    )
-    conn.commit()
-    conn.close()
+    return result
 
-def verify_otp(email, otp):
-    """驗證 OTP 是否正確且未過期"""
+# 支出列表第一頁與下一頁（after 之後），欄位順序見 expense_items()
+EXPENSES_QUERY = """
+    SELECT e.id, e.title, e.amount, e.payer_email, e.created_at, u.name
+    FROM expenses e
+    LEFT JOIN users u ON u.email = e.payer_email
+    WHERE e.room_id = ?
+    ORDER BY e.created_at DESC, e.id DESC
+    LIMIT ?
+"""
+EXPENSES_AFTER_QUERY = """
+    SELECT e.id, e.title, e.amount, e.payer_email, e.created_at, u.name
+    FROM expenses e
+    LEFT JOIN users u ON u.email = e.payer_email
+    WHERE e.room_id = ? AND (e.created_at, e.id) < (?, ?)
+    ORDER BY e.created_at DESC, e.id DESC
+    LIMIT ?
+"""
+EXPENSE_ITEM_QUERY = """
+    SELECT e.id, e.title, e.amount, e.payer_email, e.created_at, u.name
+    FROM expenses e
+    LEFT JOIN users u ON u.email = e.payer_email
+    WHERE e.id = ? AND e.room_id = ?
+"""
+
+def get_expense_page(room_id, limit, after=None):
+    """
+    以 keyset 分頁取得房間支出（含付款人與參與者名稱），依 (created_at, id) 由新到舊
+    
+    after 為上一頁最後一筆的 (created_at, id)；
+    回傳 (支出列表, 下一頁的 (created_at, id) 或 None)
+    """
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT expires_at FROM login_tokens WHERE email=? AND otp=?",
-        (email, otp)
-    )
-    result = cursor.fetchone()
-    conn.close()
+    # 多取一筆用來判斷是否還有下一頁
+    if after:
+        cursor.execute(EXPENSES_AFTER_QUERY, (room_id, after[0], after[1], limit + 1))
+    else:
+        cursor.execute(EXPENSES_QUERY, (room_id, limit + 1))
+    expenses = cursor.fetchall()
     
-    if not result:
-        return False
+    has_more = len(expenses) > limit
+    expenses = expenses[:limit]
     
-    expires_at = datetime.fromisoformat(result[0])
-    if datetime.now() > expires_at:
-        return False
+    next_key = None
+    if has_more:
+        last = expenses[-1]
+        next_key = (last[4], last[0])
     
-    return True
+    return expense_items(expenses), next_key
+
+def get_expense_item(room_id, expense_id):
+    """取得單筆支出（格式與支出列表相同），不存在時回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(EXPENSE_ITEM_QUERY, (expense_id, room_id))
+    items = expense_items(cursor.fetchall())
+    return items[0] if items else None
+
+def expense_items(rows):
+    """將 (id, title, amount, payer_email, created_at, 付款人名稱) 查詢結果加上參與者，轉成回應格式"""
+    participants_map = get_expense_participants([row[0] for row in rows])
+    
+    result = []
+    for expense_id, title, amount, payer_email, created_at, payer_name in rows:
+        participants = participants_map.get(expense_id, [])
+        result.append({
+            "id": expense_id,
+            "title": title,
+            "amount": amount,
+            "payer_email": payer_email,
+            "payer_name": payer_name if payer_name else payer_email,
+            "created_at": created_at,
+            "participants": [email for email, _ in participants],
+            "participant_names": dict(participants)
+        })
+    return result
+
+# 匯出用：一次串流取出支出與參與者（含名稱），每位參與者一列
+EXPORT_ROWS_QUERY = """
+    SELECT e.id, e.created_at, e.title, e.amount,
+           COALESCE(NULLIF(pu.name, ''), e.payer_email),
+           COALESCE(NULLIF(u.name, ''), ep.email)
+    FROM expenses e
+    LEFT JOIN users pu ON pu.email = e.payer_email
+    LEFT JOIN expense_participants ep ON ep.expense_id = e.id
+    LEFT JOIN users u ON u.email = ep.email
+    WHERE e.room_id = ?
+    ORDER BY e.created_at DESC, e.id DESC, ep.email
+"""
+
+def iter_export_rows(room_id, batch_size=500):
+    """
+    逐筆產生匯出用的支出列：(日期, 標題, 金額, 付款人名稱, 參與者名稱字串)
+    
+    以單一 cursor 分批 fetchmany，記憶體用量與房間大小無關
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(EXPORT_ROWS_QUERY, (room_id,))
+    
+    current_id = None
+    current = None
+    names = []
+    
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for expense_id, created_at, title, amount, payer_name, participant_name in rows:
+            if expense_id != current_id:
+                if current is not None:
+                    yield current + (', '.join(names),)
+                current_id = expense_id
+                current = (created_at, title, amount, payer_name)
+                names = []
+            if participant_name is not None:
+                names.append(participant_name)
+    
+    if current is not None:
+        yield current + (', '.join(names),)
+
+PAYER_TOTALS_QUERY = "SELECT payer_email, SUM(amount) FROM expenses WHERE room_id=? GROUP BY payer_email"
+
+def get_expense_totals(room_id):
+    """取得房間的總消費與每位付款人的支出總額"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute(PAYER_TOTALS_QUERY, (room_id,))
+    by_payer = {row[0]: row[1] for row in cursor.fetchall()}
+    
+    return {
+        "total": sum(by_payer.values()),
+        "by_payer": by_payer
+    }
+
+def save_otp(email, otp):
+    """儲存 OTP（OTP_TTL_SECONDS 秒內有效，覆蓋先前的 OTP）"""
+    otp_store.save(email, otp)
+
+def verify_otp(email, otp):
+    """驗證 OTP 是否正確且未過期，驗證成功即失效（只能使用一次）"""
+    return otp_store.consume(email, otp)
 
 def is_user_verified(email):
     """檢查使用者是否已驗證"""
@@ -130,7 +474,6 @@ def is_user_verified(email):
     
     cursor.execute("SELECT verified FROM users WHERE email=?", (email,))
     result = cursor.fetchone()
-    conn.close()
     
     if not result:
         return False
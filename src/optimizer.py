@@ -0,0 +1,203 @@
+import os
+import time
+
+# 最少轉帳模式的參數
+# 非零餘額人數不超過 EXACT_LIMIT 時用位元遮罩 DP 求最佳解，否則改用啟發式
+EXACT_LIMIT = int(os.getenv("SETTLEMENT_EXACT_LIMIT", "14"))
+# 單次計算的時間上限（毫秒），超過時改用目前能得到的結果
+TIME_BUDGET_MS = int(os.getenv("SETTLEMENT_TIME_BUDGET_MS", "200"))
+
+class TimeBudgetExceeded(Exception):
+    """超過計算時間上限"""
+    pass
+
+def greedy_payments(balances):
+    """
+    雙指針配對：債權人與債務人各自由大到小排序後依序配對
+    
+    balances 為 [(email, balance), ...]，最多產生 N-1 筆轉帳
+    """
+    # 分離債權人和債務人
+    creditors = [(email, balance) for email, balance in balances if balance > 0]
+    debtors = [(email, -balance) for email, balance in balances if balance < 0]
+    
+    # 排序：債權人從大到小，債務人從大到小
+    creditors.sort(key=lambda x: x[1], reverse=True)
+    debtors.sort(key=lambda x: x[1], reverse=True)
+    
+    payments = []
+    i = 0  # 債權人索引
+    j = 0  # 債務人索引
+    
+    while i < len(creditors) and j < len(debtors):
+        creditor_email, creditor_amount = creditors[i]
+        debtor_email, debtor_amount = debtors[j]
+        
+        payment_amount = min(creditor_amount, debtor_amount)
+        
+        if payment_amount > 0:
+            payments.append({
+                "from": debtor_email,
+                "to": creditor_email,
+                "amount": payment_amount
+            })
+        
+        creditors[i] = (creditor_email, creditor_amount - payment_amount)
+        debtors[j] = (debtor_email, debtor_amount - payment_amount)
+        
+        if creditors[i][1] == 0:
+            i += 1
+        if debtors[j][1] == 0:
+            j += 1
+    
+    return payments
+
+def _pair_opposites(items):
+    """
+    先把金額剛好相反的兩人配成一組
+    
+    這樣的配對一定存在於某個最佳解中，可以縮小後續搜尋的規模。
+    回傳 (配好的組別, 剩下的項目)
+    """
+    waiting = {}  # balance -> [尚未配對的項目]
+    groups = []
+    rest = []
+    
+    for item in items:
+        candidates = waiting.get(-item[1])
+        if candidates:
+            groups.append([candidates.pop(), item])
+        else:
+            waiting.setdefault(item[1], []).append(item)
+    
+    for candidates in waiting.values():
+        rest.extend(candidates)
+    
+    return groups, rest
+
+def _exact_groups(items, deadline):
+    """
+    位元遮罩 DP：把項目切成最多個總和為零的子集合
+    
+    dp[mask] 為 mask 內的項目最多能切出幾個零和子集合（最後一組可以不為零），
+    k 人的一組只需要 k-1 筆轉帳，所以組數越多轉帳越少。
+    """
+    n = len(items)
+    size = 1 << n
+    amounts = [balance for _, balance in items]
+    
+    # 子集合總和：利用最低位元遞推
+    sums = [0] * size
+    for mask in range(1, size):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + amounts[low.bit_length() - 1]
+    
+    dp = [0] * size
+    for mask in range(1, size):
+        if mask & 0xFFF == 0 and time.monotonic() > deadline:
+            raise TimeBudgetExceeded()
+        
+        best = 0
+        rest = mask
+        while rest:
+            low = rest & -rest
+            rest ^= low
+            value = dp[mask ^ low]
+            if value > best:
+                best = value
+        dp[mask] = best + (1 if sums[mask] == 0 else 0)
+    
+    # 回溯：逐一拿掉項目，遇到總和為零的前綴就切出一組
+    groups = []
+    current = []
+    mask = size - 1
+    while mask:
+        bonus = 1 if sums[mask] == 0 else 0
+        if bonus and current:
+            groups.append(current)
+            current = []
+        rest = mask
+        while rest:
+            low = rest & -rest
+            rest ^= low
+            if dp[mask ^ low] + bonus == dp[mask]:
+                current.append(items[low.bit_length() - 1])
+                mask ^= low
+                break
+    if current:
+        groups.append(current)
+    
+    return groups
+
+def _heuristic_groups(items, deadline):
+    """
+    啟發式：在時間上限內找出三人一組的零和子集合，其餘交給雙指針配對
+    """
+    groups = []
+    remaining = sorted(items, key=lambda item: item[1])
+    
+    found = True
+    while found and len(remaining) >= 3 and time.monotonic() <= deadline:
+        found = False
+        index_by_balance = {}
+        for index, (_, balance) in enumerate(remaining):
+            index_by_balance.setdefault(balance, []).append(index)
+        
+        for i in range(len(remaining)):
+            if time.monotonic() > deadline:
+                break
+            for j in range(i + 1, len(remaining)):
+                target = -(remaining[i][1] + remaining[j][1])
+                k = next((k for k in index_by_balance.get(target, []) if k > j), None)
+                if k is not None:
+                    groups.append([remaining[i], remaining[j], remaining[k]])
+                    remaining = [item for index, item in enumerate(remaining) if index not in (i, j, k)]
+                    found = True
+                    break
+            if found:
+                break
+    
+    if remaining:
+        groups.append(remaining)
+    
+    return groups
+
+def min_transfer_payments(balances, time_budget_ms=None):
+    """
+    盡量減少轉帳筆數的結算
+    
+    把成員切成總和為零的子集合，每組各自以雙指針配對。
+    回傳 (payments, algorithm)，algorithm 為 "exact" 或 "heuristic"
+    """
+    if time_budget_ms is None:
+        time_budget_ms = TIME_BUDGET_MS
+    deadline = time.monotonic() + time_budget_ms / 1000
+    
+    items = [(email, balance) for email, balance in balances if balance != 0]
+    
+    # 整數除法可能留下零頭，加入一個虛擬成員讓總和為零，最後再去掉和它相關的轉帳
+    remainder = sum(balance for _, balance in items)
+    if remainder:
+        items.append((None, -remainder))
+    
+    groups, rest = _pair_opposites(items)
+    
+    algorithm = "exact"
+    if len(rest) <= EXACT_LIMIT:
+        try:
+            groups.extend(_exact_groups(rest, deadline))
+        except TimeBudgetExceeded:
+            algorithm = "heuristic"
+    else:
+        algorithm = "heuristic"
+    
+    if algorithm == "heuristic":
+        groups.extend(_heuristic_groups(rest, deadline))
+    
+    payments = []
+    for group in groups:
+        for payment in greedy_payments(group):
+            if payment["from"] is not None and payment["to"] is not None:
+                payments.append(payment)
+    
+    return payments, algorithm
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from database import get_db
+
+# OTP 有效秒數
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+
+# 儲存方式：sqlite（預設，多個 worker 共用）或 memory（單一行程部署使用，重啟後失效）
+OTP_BACKEND = os.getenv("OTP_BACKEND", "sqlite")
+
+# 背景清除過期 OTP 的間隔秒數
+OTP_PURGE_INTERVAL = float(os.getenv("OTP_PURGE_INTERVAL", "300"))
+
+# 驗證並刪除 OTP（每組只能使用一次）與清除過期 OTP
+CONSUME_OTP_QUERY = "DELETE FROM login_tokens WHERE email=? AND otp=? AND expires_at >= ? RETURNING email"
+PURGE_OTP_QUERY = "DELETE FROM login_tokens WHERE expires_at < ?"
+
+class SQLiteOTPStore:
+    """OTP 存在 login_tokens 表，每個 email 只保留最新的一組，過期時間為 epoch 秒數"""
+    
+    def save(self, email, otp):
+        """儲存 OTP（覆蓋同一個 email 先前的 OTP）"""
+        conn = get_db()
+        conn.execute(
+            """
+            INSERT INTO login_tokens (email, otp, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (email) DO UPDATE SET otp = excluded.otp, expires_at = excluded.expires_at
+            """,
+            (email, otp, int(time.time()) + OTP_TTL_SECONDS)
+        )
+        conn.commit()
+    
+    def consume(self, email, otp):
+        """驗證成功時刪除 OTP 並回傳 True（每組 OTP 只能使用一次）"""
+        conn = get_db()
+        cursor = conn.execute(CONSUME_OTP_QUERY, (email, otp, int(time.time())))
+        consumed = cursor.fetchone() is not None
+        conn.commit()
+        return consumed
+    
+    def purge(self):
+        """刪除已過期的 OTP，回傳刪除筆數"""
+        conn = get_db()
+        cursor = conn.execute(PURGE_OTP_QUERY, (int(time.time()),))
+        conn.commit()
+        return cursor.rowcount
+    
+    def size(self):
+        cursor = get_db().execute("SELECT COUNT(*) FROM login_tokens")
+        return cursor.fetchone()[0]
+
+class MemoryOTPStore:
+    """OTP 存在行程記憶體中（只適用單一行程部署，重啟後所有 OTP 失效）"""
+    
+    def __init__(self):
+        self._tokens = {}  # email -> (otp, 過期時間)
+        self._lock = threading.Lock()
+    
+    def save(self, email, otp):
+        with self._lock:
+            self._tokens[email] = (otp, int(time.time()) + OTP_TTL_SECONDS)
+    
+    def consume(self, email, otp):
+        with self._lock:
+            token = self._tokens.get(email)
+            if token is None or token[0] != otp or token[1] < int(time.time()):
+                return False
+            del self._tokens[email]
+            return True
+    
+    def purge(self):
+        now = int(time.time())
+        with self._lock:
+            expired = [email for email, (_, expires_at) in self._tokens.items() if expires_at < now]
+            for email in expired:
+                del self._tokens[email]
+        return len(expired)
+    
+    def size(self):
+        with self._lock:
+            return len(self._tokens)
+
+BACKENDS = {
+    "sqlite": SQLiteOTPStore,
+    "memory": MemoryOTPStore,
+}
+
+if OTP_BACKEND not in BACKENDS:
+    raise ValueError(f"未知的 OTP 儲存方式：{OTP_BACKEND}")
+
+otp_store = BACKENDS[OTP_BACKEND]()
+
+class OTPPurger(threading.Thread):
+    """定期清除過期的 OTP"""
+    
+    def __init__(self, store, interval=OTP_PURGE_INTERVAL):
+        super().__init__(name="otp-purger", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.purged = 0
+        self._stopping = threading.Event()
+    
+    def stop(self):
+        self._stopping.set()
+    
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.purged += self.store.purge()
+            except Exception as e:
+                print(f"OTP purge error: {e}")
+
+_purger = None
+_purger_lock = threading.Lock()
+
+def start_otp_purger():
+    """啟動背景清除執行緒（每個行程只啟動一次）"""
+    global _purger
+    if _purger is not None:
+        return
+    with _purger_lock:
+        if _purger is None:
+            purger = OTPPurger(otp_store)
+            purger.start()
+            _purger = purger
+
+def otp_stats():
+    return {
+        "backend": OTP_BACKEND,
+        "active": otp_store.size(),
+        "purged": _purger.purged if _purger is not None else 0
+    }
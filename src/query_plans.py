@@ -0,0 +1,99 @@
+import re
+from auth import ADMINS_QUERY, ROOM_ACCESS_QUERY
+from calculations import TOTALS_QUERY, STORED_PARTICIPANTS_QUERY, BALANCES_QUERY
+from mail_queue import CLAIM_QUERY
+from models import (
+    USER_NAMES_QUERY, BUMP_MEMBER_ROOMS_QUERY, ROOM_VERSION_QUERY, ROOM_VALIDATORS_QUERY,
+    ROOMS_QUERY, ALL_ROOMS_QUERY, ROOM_QUERY, ROOM_MEMBERS_QUERY, MEMBER_SET_QUERY,
+    DELETE_ROOM_PARTICIPANTS_QUERY, DELETE_ROOM_EXPENSES_QUERY, EXPENSE_EXISTS_QUERY,
+    EXPENSE_PARTICIPANTS_QUERY, EXPENSES_QUERY, EXPENSES_AFTER_QUERY, EXPENSE_ITEM_QUERY,
+    PAYER_TOTALS_QUERY, EXPORT_ROWS_QUERY,
+    ALL_USERS_QUERY, PAYER_ROOMS_QUERY, DELETE_USER_MEMBERSHIPS_QUERY, DELETE_OWNED_ROOMS_QUERY,
+    USER_EXISTS_QUERY, USER_NAME_QUERY, MEMBER_ROOMS_QUERY, DELETE_PAYER_PARTICIPANTS_QUERY, DELETE_USER_QUERY
+)
+from otp_store import CONSUME_OTP_QUERY, PURGE_OTP_QUERY
+from ratelimit import RATE_LIMIT_QUERY, PURGE_RATE_LIMITS_QUERY
+
+def _in_list(query, count=2):
+    """IN (...) 查詢的範本以 count 個 ? 代入"""
+    return query.format(placeholders=", ".join(["?"] * count))
+
+# 各路由使用的熱門查詢，用 EXPLAIN QUERY PLAN 檢查是否退化成全表掃描
+# 格式：(名稱, SQL, 是否允許全表掃描)
+# SQL 直接取自執行查詢的模組常數，修改路由查詢後執行 python src/manage.py check-plans 即會檢查新的查詢；
+# 新增路由查詢時請定義成常數並加到這裡
+HOT_QUERIES = [
+    ("get_rooms（一般使用者）", ROOMS_QUERY, False),
+    ("get_rooms（管理員）", ALL_ROOMS_QUERY, True),
+    ("get_room", ROOM_QUERY, False),
+    ("get_room_version（事件串流）", ROOM_VERSION_QUERY, False),
+    ("get_room_validators（ETag）", ROOM_VALIDATORS_QUERY, False),
+    ("bump_member_rooms（名稱變更）", BUMP_MEMBER_ROOMS_QUERY, False),
+    ("get_room 成員", ROOM_MEMBERS_QUERY, False),
+    ("get_room_access", ROOM_ACCESS_QUERY, False),
+    ("get_admin_set", ADMINS_QUERY, True),
+    ("get_user_names", _in_list(USER_NAMES_QUERY), False),
+    ("get_expenses", EXPENSES_QUERY, False),
+    ("get_expense_item（事件內容）", EXPENSE_ITEM_QUERY, False),
+    ("get_expenses 下一頁", EXPENSES_AFTER_QUERY, False),
+    ("get_expenses 參與者", _in_list(EXPENSE_PARTICIPANTS_QUERY), False),
+    ("get_expenses 統計", PAYER_TOTALS_QUERY, False),
+    ("支出參與者", STORED_PARTICIPANTS_QUERY, False),
+    ("create_expense 成員驗證", _in_list(MEMBER_SET_QUERY), False),
+    ("update_expense / delete_expense 支出檢查", EXPENSE_EXISTS_QUERY, False),
+    ("calculate_settlement", BALANCES_QUERY, False),
+    ("重建餘額彙總", TOTALS_QUERY, False),
+    ("匯出支出記錄", EXPORT_ROWS_QUERY, False),
+    ("delete_room 參與者", DELETE_ROOM_PARTICIPANTS_QUERY, False),
+    ("delete_room 支出", DELETE_ROOM_EXPENSES_QUERY, False),
+    ("verify_otp", CONSUME_OTP_QUERY, False),
+    ("清除過期 OTP", PURGE_OTP_QUERY, False),
+    ("限流計數", RATE_LIMIT_QUERY, False),
+    ("清除過期限流計數", PURGE_RATE_LIMITS_QUERY, False),
+    ("get_all_users", ALL_USERS_QUERY, True),
+    ("delete_user 成員關係", DELETE_USER_MEMBERSHIPS_QUERY, False),
+    ("delete_user 擁有的房間", DELETE_OWNED_ROOMS_QUERY, False),
+    ("寄送佇列取出到期郵件", CLAIM_QUERY, False),
+    ("使用者是否存在", USER_EXISTS_QUERY, False),
+    ("verify_otp 使用者名稱", USER_NAME_QUERY, False),
+    ("delete_user 受影響的房間", PAYER_ROOMS_QUERY, False),
+    ("delete_user 參與的房間", MEMBER_ROOMS_QUERY, False),
+    ("delete_user 支出參與者", DELETE_PAYER_PARTICIPANTS_QUERY, False),
+    ("delete_user", DELETE_USER_QUERY, False),
+]
+
+_SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+_ALIAS_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+
+def find_full_scans(conn, queries=HOT_QUERIES):
+    """
+    找出退化成全表掃描的查詢
+    
+    回傳 [(名稱, 計畫內容), ...]；CTE、子查詢與允許掃描的查詢不列入
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = {row[0] for row in cursor.fetchall()}
+    problems = []
+    
+    for name, sql, allow_scan in queries:
+        if allow_scan:
+            continue
+        
+        # 別名對應回實際的資料表，CTE 與子查詢不會出現在 tables 中
+        aliases = {}
+        for table, alias in _ALIAS_PATTERN.findall(sql):
+            if alias:
+                aliases[alias] = table
+        
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count('?'))
+        for row in cursor.fetchall():
+            detail = row[3]
+            match = _SCAN_PATTERN.match(detail)
+            if not match:
+                continue
+            target = aliases.get(match.group(1), match.group(1))
+            if target in tables:
+                problems.append((name, detail))
+    
+    return problems
@@ -0,0 +1,216 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from database import get_db, begin_immediate
+
+# 限流計數的儲存方式：
+# memory 行程內計數（預設，項目數有上限）
+# sqlite 存在 rate_limits 表，多個 worker 行程共用
+# none   停用限流（壓測用）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# memory 模式最多保留的計數 key 數量，超過時淘汰最久未使用的 key
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+
+def parse_limit(value):
+    """解析「次數/秒數」格式的限制，例如 5/600 表示 600 秒內最多 5 次"""
+    count, seconds = value.split("/")
+    return int(count), int(seconds)
+
+# 驗證相關路由的限制：(每個 IP, 每個 email)
+# otp_send 由 send-otp 與 resend-otp 共用
+AUTH_LIMITS = {
+    "otp_send": (
+        parse_limit(os.getenv("RATE_LIMIT_OTP_SEND_IP", "20/600")),
+        parse_limit(os.getenv("RATE_LIMIT_OTP_SEND_EMAIL", "5/600")),
+    ),
+    "otp_verify": (
+        parse_limit(os.getenv("RATE_LIMIT_OTP_VERIFY_IP", "30/600")),
+        parse_limit(os.getenv("RATE_LIMIT_OTP_VERIFY_EMAIL", "10/600")),
+    ),
+}
+
+def _roll(state, now, window):
+    """
+    將計數推進到目前的時間窗
+    
+    state 為 (時間窗起點, 上一個時間窗次數, 目前時間窗次數)，時間窗起點對齊 window 的整數倍
+    """
+    window_start = int(now // window * window)
+    if state is None:
+        return window_start, 0, 0
+    
+    start, previous, current = state
+    if start == window_start:
+        return state
+    if start == window_start - window:
+        return window_start, current, 0
+    return window_start, 0, 0
+
+def _estimate(state, now, window):
+    """滑動時間窗的估計次數：上一個時間窗依重疊比例加權，加上目前時間窗的次數"""
+    window_start, previous, current = state
+    return previous * (1 - (now - window_start) / window) + current
+
+def _retry_after(state, now, limit, window):
+    """估計次數降到可以再通過一次所需的秒數"""
+    window_start, previous, current = state
+    elapsed = now - window_start
+    allowed = limit - 1
+    
+    if current <= allowed and previous > 0:
+        # 目前時間窗內，上一個時間窗的權重下降後即可通過
+        wait = window * (1 - (allowed - current) / previous) - elapsed
+    else:
+        # 要等到下一個時間窗，目前的次數變成上一個時間窗的次數
+        wait = window - elapsed
+        if current > 0:
+            wait += window * max(0, 1 - allowed / current)
+    return max(1, math.ceil(wait))
+
+class MemoryRateLimiter:
+    """行程內的滑動時間窗計數，最多保留 max_keys 個 key"""
+    
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()  # key -> (時間窗起點, 上一個時間窗次數, 目前時間窗次數)
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._rejected = 0
+    
+    def hit(self, checks):
+        """
+        checks 為 [(key, 次數上限, 時間窗秒數)]
+        
+        全部未超過時各計一次並回傳 0；任一超過時不計數，回傳需等待的秒數
+        """
+        now = time.time()
+        with self._lock:
+            states = [_roll(self._counters.get(key), now, window) for key, limit, window in checks]
+            retry_after = 0
+            for state, (key, limit, window) in zip(states, checks):
+                if _estimate(state, now, window) + 1 > limit:
+                    retry_after = max(retry_after, _retry_after(state, now, limit, window))
+            if retry_after:
+                self._rejected += 1
+                return retry_after
+            
+            for (window_start, previous, current), (key, limit, window) in zip(states, checks):
+                self._counters[key] = (window_start, previous, current + 1)
+                self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+                self._evictions += 1
+            return 0
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "keys": len(self._counters),
+                "max_keys": self.max_keys,
+                "evictions": self._evictions,
+                "rejected": self._rejected
+            }
+
+RATE_LIMIT_QUERY = "SELECT window_start, previous_count, current_count FROM rate_limits WHERE key=?"
+PURGE_RATE_LIMITS_QUERY = "DELETE FROM rate_limits WHERE expires_at < ?"
+
+class SQLiteRateLimiter:
+    """計數存在 rate_limits 表，多個 worker 行程共用"""
+    
+    # 清除過期計數的最短間隔秒數
+    PURGE_INTERVAL = 60
+    
+    def __init__(self):
+        self._last_purge = 0
+        self._rejected = 0
+    
+    def hit(self, checks):
+        """與 MemoryRateLimiter.hit 相同，計數的讀取與更新在同一個寫入交易內完成"""
+        now = time.time()
+        conn = get_db()
+        begin_immediate(conn)
+        try:
+            states = []
+            retry_after = 0
+            for key, limit, window in checks:
+                cursor = conn.execute(RATE_LIMIT_QUERY, (key,))
+                row = cursor.fetchone()
+                state = _roll(tuple(row) if row else None, now, window)
+                states.append(state)
+                if _estimate(state, now, window) + 1 > limit:
+                    retry_after = max(retry_after, _retry_after(state, now, limit, window))
+            
+            if retry_after:
+                conn.rollback()
+                self._rejected += 1
+                return retry_after
+            
+            conn.executemany(
+                """
+                INSERT INTO rate_limits (key, window_start, previous_count, current_count, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    window_start = excluded.window_start,
+                    previous_count = excluded.previous_count,
+                    current_count = excluded.current_count,
+                    expires_at = excluded.expires_at
+                """,
+                [
+                    (key, window_start, previous, current + 1, window_start + 2 * window)
+                    for (window_start, previous, current), (key, limit, window) in zip(states, checks)
+                ]
+            )
+            
+            # 兩個時間窗之後計數已不影響估計值，定期刪除
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                conn.execute(PURGE_RATE_LIMITS_QUERY, (int(now),))
+            conn.commit()
+            return 0
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def stats(self):
+        cursor = get_db().execute("SELECT COUNT(*) FROM rate_limits")
+        return {
+            "backend": "sqlite",
+            "keys": cursor.fetchone()[0],
+            "rejected": self._rejected
+        }
+
+class NullRateLimiter:
+    """不限流"""
+    
+    def hit(self, checks):
+        return 0
+    
+    def stats(self):
+        return {"backend": "none"}
+
+BACKENDS = {
+    "memory": MemoryRateLimiter,
+    "sqlite": SQLiteRateLimiter,
+    "none": NullRateLimiter,
+}
+
+if RATE_LIMIT_BACKEND not in BACKENDS:
+    raise ValueError(f"未知的限流儲存方式：{RATE_LIMIT_BACKEND}")
+
+rate_limiter = BACKENDS[RATE_LIMIT_BACKEND]()
+
+def check_auth_limit(action, ip, email):
+    """
+    檢查驗證路由的 IP 與 email 限制
+    
+    通過時計數並回傳 0，超過時回傳需等待的秒數（用於 Retry-After）
+    """
+    (ip_limit, ip_window), (email_limit, email_window) = AUTH_LIMITS[action]
+    return rate_limiter.hit([
+        (f"{action}:ip:{ip}", ip_limit, ip_window),
+        (f"{action}:email:{email}", email_limit, email_window),
+    ])
@@ -0,0 +1,246 @@
+"""
+房間頁面讀取 API 的共用邏輯
+
+Flask 路由（app.py）與 ASGI 應用程式（asgi.py）共用。載入函式回傳 (HTTP 狀態碼, 回應內容 dict)；
+房間相關的讀取 API 另外支援條件式 GET，回傳 (狀態碼, 回應內容, 回應標頭)，304 時內容為 None。
+由呼叫端序列化。只使用 get_db()，在請求中或執行緒池中呼叫皆可。
+"""
+import hashlib
+import os
+from werkzeug.http import http_date, parse_etags, quote_etag
+from auth import is_admin, can_access_room
+from encoding import ETAG_SUFFIXES
+from models import get_user_name, get_user_names, get_room_validators, get_expense_page, get_expense_item, get_expense_totals, encode_cursor, decode_cursor, ROOM_QUERY, ROOM_MEMBERS_QUERY
+from calculations import get_room_settlement, SETTLEMENT_MODES
+from database import get_db
+
+# 支出列表分頁設定
+EXPENSES_PAGE_SIZE = int(os.getenv("EXPENSES_PAGE_SIZE", "50"))
+EXPENSES_MAX_PAGE_SIZE = int(os.getenv("EXPENSES_MAX_PAGE_SIZE", "200"))
+
+FORBIDDEN = (403, {"error": "無權限存取此房間"})
+NOT_FOUND = (404, {"error": "房間不存在"})
+BAD_MODE = (400, {"error": "不支援的結算模式"})
+
+# 瀏覽器可以保存回應，但每次使用前都要以 ETag 向伺服器重新驗證
+CACHE_CONTROL = "private, no-cache"
+
+def variant_digest(variant):
+    """將回應的變化因素（路由、查詢參數、使用者等）摘要成短字串"""
+    return hashlib.blake2b(repr(variant).encode('utf-8'), digest_size=6).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 標頭是否包含 etag（未加引號），壓縮版本的 ETag（加上 -gzip 等後綴）也算相符"""
+    if not if_none_match:
+        return False
+    
+    etags = parse_etags(if_none_match)
+    return etags.contains_weak(etag) or any(
+        etags.contains_weak(etag + suffix) for suffix in ETAG_SUFFIXES.values()
+    )
+
+def conditional(email, room_id, variant, if_none_match, view):
+    """
+    以房間版本號處理條件式 GET
+    
+    先檢查權限並只讀取 rooms 的版本號與最後修改時間產生強 ETag，
+    If-None-Match 相符時直接回傳 304，不執行 view（不查詢支出相關資料表、不序列化）。
+    房間內容（支出、成員、成員名稱）變動時寫入路由都會遞增版本號。
+    view() 回傳 (狀態碼, 內容)；回傳 (狀態碼, 內容, 標頭)
+    """
+    if not can_access_room(email, room_id):
+        return FORBIDDEN + ({},)
+    
+    validators = get_room_validators(room_id)
+    if validators is None:
+        return NOT_FOUND + ({},)
+    
+    version, updated_at = validators
+    etag = f"{room_id}.{version}.{variant_digest(variant)}"
+    headers = {"ETag": quote_etag(etag), "Cache-Control": CACHE_CONTROL}
+    if updated_at:
+        headers["Last-Modified"] = http_date(updated_at)
+    
+    if etag_matches(if_none_match, etag):
+        return 304, None, headers
+    
+    status, body = view()
+    if status != 200:
+        return status, body, {}
+    return status, body, headers
+
+def user_info(email):
+    """目前使用者的 email、名稱與是否為管理員"""
+    return 200, {
+        "email": email,
+        "name": get_user_name(email),
+        "is_admin": is_admin(email)
+    }
+
+def load_room(room_id):
+    """房間資訊與成員名稱（不檢查權限），房間不存在時回傳 None"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # 取得房間資訊
+    cursor.execute(ROOM_QUERY, (room_id,))
+    room = cursor.fetchone()
+    
+    if not room:
+        return None
+    
+    # 取得房間成員
+    cursor.execute(ROOM_MEMBERS_QUERY, (room_id,))
+    member_emails = [member[0] for member in cursor.fetchall()]
+    
+    # 成員與擁有者的名稱一次查詢
+    names = get_user_names(member_emails + [room[2]])
+    
+    return {
+        "id": room[0],
+        "name": room[1],
+        "owner_email": room[2],
+        "owner_name": names.get(room[2], room[2]),
+        "created_at": room[3],
+        "version": room[4],
+        "members": member_emails,
+        "member_names": {member: names[member] for member in member_emails if member in names}
+    }
+
+def room_detail(email, room_id, if_none_match=None):
+    """房間資訊與成員名稱"""
+    def view():
+        room = load_room(room_id)
+        if room is None:
+            return NOT_FOUND
+        return 200, room
+    
+    return conditional(email, room_id, ("room",), if_none_match, view)
+
+def load_expense_page(room_id, limit, after=None):
+    """一頁支出與下一頁游標（不檢查權限），第一頁附上 totals"""
+    expenses, next_key = get_expense_page(room_id, limit, after)
+    
+    result = {
+        "expenses": expenses,
+        "next_cursor": encode_cursor(*next_key) if next_key else None
+    }
+    if after is None:
+        result["totals"] = get_expense_totals(room_id)
+    return result
+
+def expense_listing(email, room_id, limit=None, cursor_str=None, if_none_match=None):
+    """
+    分頁取得房間的支出
+    
+    limit、cursor_str 為查詢參數的原始字串；limit 無法解析時使用 EXPENSES_PAGE_SIZE。
+    第一頁（沒有 cursor）另外附上 totals 供消費統計使用
+    """
+    if not can_access_room(email, room_id):
+        return FORBIDDEN + ({},)
+    
+    try:
+        limit = int(limit) if limit is not None else EXPENSES_PAGE_SIZE
+    except ValueError:
+        limit = EXPENSES_PAGE_SIZE
+    if limit <= 0:
+        return 400, {"error": "每頁筆數必須大於 0"}, {}
+    limit = min(limit, EXPENSES_MAX_PAGE_SIZE)
+    
+    after = None
+    if cursor_str:
+        after = decode_cursor(cursor_str)
+        if after is None:
+            return 400, {"error": "無效的分頁游標"}, {}
+    
+    return conditional(
+        email, room_id, ("expenses", limit, after), if_none_match,
+        lambda: (200, load_expense_page(room_id, limit, after))
+    )
+
+def load_settlement(room_id, mode):
+    """房間的結算結果並附上成員名稱（不檢查權限）"""
+    result = get_room_settlement(room_id, mode)
+    
+    # 取得所有用戶的名稱
+    all_emails = set()
+    for balance in result.get("balances", []):
+        all_emails.add(balance["email"])
+    for payment in result.get("payments", []):
+        all_emails.add(payment["from"])
+        all_emails.add(payment["to"])
+    
+    user_names = get_user_names(list(all_emails))
+    
+    # 添加名稱到結果中
+    for balance in result.get("balances", []):
+        balance["name"] = user_names.get(balance["email"], balance["email"])
+    
+    for payment in result.get("payments", []):
+        payment["from_name"] = user_names.get(payment["from"], payment["from"])
+        payment["to_name"] = user_names.get(payment["to"], payment["to"])
+    
+    return result
+
+def room_settlement(email, room_id, mode=None, if_none_match=None):
+    """房間的結算結果（附上成員名稱）"""
+    if not can_access_room(email, room_id):
+        return FORBIDDEN + ({},)
+    
+    if mode is None:
+        mode = 'greedy'
+    if mode not in SETTLEMENT_MODES:
+        return BAD_MODE + ({},)
+    
+    return conditional(
+        email, room_id, ("settlement", mode), if_none_match,
+        lambda: (200, load_settlement(room_id, mode))
+    )
+
+def room_bootstrap(email, room_id, mode=None, if_none_match=None):
+    """
+    房間頁面開啟時需要的全部資料：使用者、房間與成員、第一頁支出、結算
+    
+    只檢查一次權限，所有查詢使用同一條連線。
+    回應包含目前使用者的資訊，ETag 也依使用者的名稱與管理員身分區分
+    """
+    if not can_access_room(email, room_id):
+        return FORBIDDEN + ({},)
+    
+    if mode is None:
+        mode = 'greedy'
+    if mode not in SETTLEMENT_MODES:
+        return BAD_MODE + ({},)
+    
+    user = user_info(email)[1]
+    
+    def view():
+        room = load_room(room_id)
+        if room is None:
+            return NOT_FOUND
+        return 200, {
+            "user": user,
+            "room": room,
+            "expenses": load_expense_page(room_id, EXPENSES_PAGE_SIZE),
+            "settlement": load_settlement(room_id, mode)
+        }
+    
+    variant = ("bootstrap", mode, user["email"], user["name"], user["is_admin"])
+    return conditional(email, room_id, variant, if_none_match, view)
+
+def expense_change(room_id, version, event_type, expense_id):
+    """
+    單筆支出變更的事件內容：變更後的支出（刪除時只有 id）、消費統計與貪婪結算
+    
+    頁面以此更新列表與結算，不必重新載入整個房間；其他結算模式由頁面自行重新取得
+    """
+    change = {
+        "version": version,
+        "totals": get_expense_totals(room_id),
+        "settlement": load_settlement(room_id, 'greedy')
+    }
+    if event_type == "expense_deleted":
+        change["expense_id"] = expense_id
+    else:
+        change["expense"] = get_expense_item(room_id, expense_id)
+    return change
@@ -0,0 +1,131 @@
+"""
+本機 SMTP 接收端：接受所有郵件但不轉寄，用於開發與效能測試
+
+不需要 Gmail 帳號即可測試寄信流程；可用 SMTP_SINK_CONNECT_DELAY_MS 與
+SMTP_SINK_SEND_DELAY_MS 模擬真實伺服器的握手與寄送延遲。
+
+單獨執行：python src/smtp_sink.py [--host 127.0.0.1] [--port 8025]
+"""
+import argparse
+import collections
+import os
+import socketserver
+import threading
+import time
+
+SMTP_SINK_HOST = os.getenv("SMTP_SINK_HOST", "127.0.0.1")
+SMTP_SINK_PORT = int(os.getenv("SMTP_SINK_PORT", "8025"))
+SMTP_SINK_CONNECT_DELAY_MS = float(os.getenv("SMTP_SINK_CONNECT_DELAY_MS", "0"))
+SMTP_SINK_SEND_DELAY_MS = float(os.getenv("SMTP_SINK_SEND_DELAY_MS", "0"))
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """處理一條 SMTP 連線（只實作寄信需要的指令）"""
+    
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+    
+    def handle(self):
+        sink = self.server
+        if sink.connect_delay:
+            time.sleep(sink.connect_delay)
+        sink.count_connection()
+        self.reply("220 localhost smtp-sink ready")
+        
+        sender = None
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                sender = command[10:].strip()
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                if sink.send_delay:
+                    time.sleep(sink.send_delay)
+                sink.record(sender, recipients, size)
+                self.reply("250 OK: queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """接受所有郵件的 SMTP 伺服器，保留最近收到的郵件紀錄"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, host=SMTP_SINK_HOST, port=SMTP_SINK_PORT,
+                 connect_delay_ms=SMTP_SINK_CONNECT_DELAY_MS, send_delay_ms=SMTP_SINK_SEND_DELAY_MS,
+                 keep=1000, on_message=None):
+        super().__init__((host, port), SinkHandler)
+        self.connect_delay = connect_delay_ms / 1000
+        self.send_delay = send_delay_ms / 1000
+        self.on_message = on_message
+        self.messages = collections.deque(maxlen=keep)  # (收到時間, 寄件人, 收件人列表, 大小)
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+    
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+    
+    def record(self, sender, recipients, size):
+        received_at = time.time()
+        with self._lock:
+            self.received += 1
+            self.messages.append((received_at, sender, recipients, size))
+        if self.on_message is not None:
+            self.on_message(received_at, sender, recipients, size)
+
+def start_sink(host=SMTP_SINK_HOST, port=SMTP_SINK_PORT, **kwargs):
+    """在背景執行緒啟動接收端並回傳伺服器物件"""
+    sink = SMTPSink(host, port, **kwargs)
+    thread = threading.Thread(target=sink.serve_forever, name="smtp-sink", daemon=True)
+    thread.start()
+    return sink
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 SMTP 接收端（不轉寄）")
+    parser.add_argument("--host", default=SMTP_SINK_HOST)
+    parser.add_argument("--port", type=int, default=SMTP_SINK_PORT)
+    parser.add_argument("--connect-delay-ms", type=float, default=SMTP_SINK_CONNECT_DELAY_MS)
+    parser.add_argument("--send-delay-ms", type=float, default=SMTP_SINK_SEND_DELAY_MS)
+    args = parser.parse_args()
+    
+    def show(received_at, sender, recipients, size):
+        print(f"{time.strftime('%H:%M:%S')} {sender} -> {', '.join(recipients)} ({size} bytes)")
+    
+    sink = SMTPSink(args.host, args.port, args.connect_delay_ms, args.send_delay_ms, on_message=show)
+    print(f"SMTP 接收端監聽 {args.host}:{args.port}")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
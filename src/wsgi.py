@@ -0,0 +1,32 @@
+"""
+正式環境的 WSGI 進入點
+
+Linux：gunicorn -c gunicorn.conf.py（設定檔載入 wsgi:app，並在啟動時執行一次資料庫遷移）
+Windows：python src/wsgi.py（使用 waitress，多執行緒單一行程）
+
+監聽位址與執行緒數與 gunicorn 共用 BIND、WEB_THREADS 等環境變數。
+"""
+import os
+from app import app
+from database import init_db
+
+BIND = os.getenv("BIND", "0.0.0.0:5000")
+# 每個行程的處理執行緒數，不應超過 DB_POOL_SIZE
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+# 閒置連線保留的秒數
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+
+def main():
+    """以 waitress 啟動（gunicorn 不支援 Windows）"""
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("找不到 waitress，請執行 pip install -r requirements.txt")
+    
+    init_db()
+    
+    host, port = BIND.rsplit(":", 1)
+    serve(app, host=host, port=int(port), threads=WEB_THREADS, channel_timeout=WEB_KEEPALIVE)
+
+if __name__ == '__main__':
+    main()